@@ -5,22 +5,22 @@ Now with user authentication, role-based access, and per-user encrypted token st
 """
 
 import streamlit as st
-import requests
 import pandas as pd
 import numpy as np
 import plotly.express as px
 import plotly.graph_objects as go
 from typing import Dict, List, Any, Tuple, Optional
-import json
 import time
 from datetime import datetime, timedelta
 import io
+import functools
 from pathlib import Path
 
 # Import custom modules
 from auth import UserManager
 from security import TokenManager
-from storage import HistoryDatabase
+from storage import HistoryDatabase, dataframe_to_csv_bytes
+from sonarr_api import DEFAULT_TIMEOUT, fetch_sonarr_data, fetch_episode_files
 
 # Page configuration
 st.set_page_config(
@@ -31,10 +31,7 @@ st.set_page_config(
 )
 
 # Constants
-DEFAULT_TIMEOUT = 10
 DEFAULT_Z_THRESHOLD = 2.0
-MAX_RETRIES = 2
-MAX_RESPONSE_SIZE = 200 * 1024 * 1024  # 200 MB
 DB_PATH = "data/sonarr_history.db"
 USER_DB_PATH = "data/users.db"
 TOKEN_DB_PATH = "data/tokens.db"
@@ -50,8 +47,12 @@ if 'user_manager' not in st.session_state:
 if 'token_manager' not in st.session_state:
     st.session_state.token_manager = TokenManager(TOKEN_DB_PATH, MASTER_KEY_PATH)
 
-if 'history_db' not in st.session_state:
-    st.session_state.history_db = HistoryDatabase(DB_PATH)
+
+@st.cache_resource
+def get_history_db() -> HistoryDatabase:
+    """History database shared by all sessions (schema setup runs once)."""
+    return HistoryDatabase(DB_PATH)
+
 
 # Custom CSS
 st.markdown("""
@@ -118,136 +119,111 @@ def load_user_token():
 # SONARR API FUNCTIONS
 # ============================================================================
 
-def validate_url(url: str) -> Tuple[bool, str, str]:
-    """Validate and sanitize base URL."""
+@functools.lru_cache(maxsize=32)
+def _normalize_url(url: str) -> Tuple[bool, str, str, bool]:
+    """Validate and sanitize base URL without Streamlit side effects."""
     if not url:
-        return False, "", "URL cannot be empty"
+        return False, "", "URL cannot be empty", False
     
     url = url.strip().rstrip('/')
+    scheme_added = False
     
     if not url.startswith(('http://', 'https://')):
         url = 'http://' + url
-        st.warning("⚠️ No scheme provided, defaulting to HTTP. Consider using HTTPS for security.")
+        scheme_added = True
     
     if not url.startswith(('http://', 'https://')):
-        return False, "", "Only HTTP and HTTPS schemes are allowed"
+        return False, "", "Only HTTP and HTTPS schemes are allowed", scheme_added
     
-    return True, url, ""
+    return True, url, "", scheme_added
 
 
-def fetch_sonarr_data(
-    endpoint: str,
-    base_url: str,
-    api_key: str,
-    timeout: int = DEFAULT_TIMEOUT,
-    params: Optional[Dict] = None
-) -> Tuple[Optional[List[Dict]], Optional[str]]:
-    """Fetch data from Sonarr API endpoint with error handling."""
-    url = f"{base_url}/{endpoint}"
-    headers = {"X-Api-Key": api_key}
+def validate_url(url: str) -> Tuple[bool, str, str]:
+    """Validate and sanitize base URL."""
+    is_valid, url, error, scheme_added = _normalize_url(url)
     
-    session = requests.Session()
-    session.headers.update(headers)
+    if scheme_added:
+        st.warning("⚠️ No scheme provided, defaulting to HTTP. Consider using HTTPS for security.")
     
-    for attempt in range(MAX_RETRIES):
-        try:
-            response = session.get(
-                url,
-                timeout=timeout,
-                params=params,
-                stream=False
-            )
-            
-            content_length = response.headers.get('content-length')
-            if content_length and int(content_length) > MAX_RESPONSE_SIZE:
-                return None, f"Response too large: {int(content_length) / (1024**2):.2f} MB"
-            
-            if response.status_code == 401:
-                return None, "❌ Authentication failed: Invalid API key"
-            elif response.status_code == 403:
-                return None, "❌ Access forbidden: Check API key permissions"
-            elif response.status_code == 404:
-                return None, "❌ Endpoint not found: Check Sonarr URL and version"
-            elif response.status_code >= 500:
-                return None, f"❌ Sonarr server error: {response.status_code}"
-            
-            response.raise_for_status()
-            data = response.json()
-            
-            if not isinstance(data, list):
-                return None, f"Unexpected response format: expected list, got {type(data).__name__}"
-            
-            return data, None
-            
-        except requests.exceptions.Timeout:
-            if attempt < MAX_RETRIES - 1:
-                time.sleep(1)
-                continue
-            return None, f"⏱️ Request timeout after {timeout}s"
-            
-        except requests.exceptions.ConnectionError:
-            return None, "🔌 Connection failed: Check URL and network connectivity"
-            
-        except requests.exceptions.RequestException as e:
-            return None, f"❌ Request error: {str(e)}"
-            
-        except json.JSONDecodeError:
-            return None, "❌ Invalid JSON response from Sonarr"
+    return is_valid, url, error
+
+
+class _UncachedResult(Exception):
+    """Carries a result out of a cached function so Streamlit does not cache it."""
     
-    return None, "Failed after multiple retries"
+    def __init__(self, result: Tuple):
+        super().__init__()
+        self.result = result
 
 
 @st.cache_data(ttl=300, show_spinner=False)
-def fetch_all_episode_files(
-    series_data: List[Dict],
+def _fetch_complete_episode_files(
+    _series_data: List[Dict],
     base_url: str,
     api_key: str,
-    timeout: int
-) -> Tuple[Optional[pd.DataFrame], Optional[str]]:
-    """Fetch episode files for all series with progress tracking."""
-    all_episode_files = []
+    timeout: int,
+    cache_key: Tuple[int, ...]
+) -> Tuple[Optional[pd.DataFrame], Optional[str], Optional[str]]:
+    """
+    Cached sonarr_api.fetch_episode_files, for complete results only.
+    
+    Streamlit does not hash _series_data; cache_key (the sorted series ids)
+    identifies the library instead.
+    """
     progress_bar = st.progress(0)
     status_text = st.empty()
+    status_text.text("Fetching all episode files...")
     
-    total_series = len(series_data)
+    # Streamlit elements are only updated from this (the script) thread, and
+    # only when the percentage moves: each update is a message to the browser
+    last_pct = -1
+    last_text_update = 0.0
     
-    for idx, series in enumerate(series_data):
-        series_id = series.get('id')
-        series_title = series.get('title', 'Unknown')
-        
-        if series_id is None:
-            continue
-        
-        progress = (idx + 1) / total_series
-        progress_bar.progress(progress)
-        status_text.text(f"Processing {idx + 1}/{total_series}: {series_title}")
-        
-        endpoint = f"api/v3/episodefile"
-        params = {"seriesId": series_id}
-        
-        episode_files, error = fetch_sonarr_data(
-            endpoint, base_url, api_key, timeout, params
-        )
+    def show_progress(done: int, total: int, title: str):
+        nonlocal last_pct, last_text_update
+        pct = done * 100 // total
+        if pct == last_pct:
+            return
         
-        if error:
-            continue
+        progress_bar.progress(pct / 100)
+        last_pct = pct
         
-        if episode_files:
-            for ef in episode_files:
-                all_episode_files.append({
-                    'episode_file_id': ef.get('id'),
-                    'series_id': ef.get('seriesId'),
-                    'size_bytes': ef.get('size', 0),
-                    'quality': ef.get('quality', {}).get('quality', {}).get('name', 'Unknown')
-                })
-    
-    progress_bar.empty()
-    status_text.empty()
-    
-    if not all_episode_files:
-        return None, "No episode files found in any series"
-    
-    return pd.DataFrame(all_episode_files), None
+        now = time.monotonic()
+        if now - last_text_update >= 0.1 or done == total:
+            status_text.text(f"Processing {done}/{total}: {title}")
+            last_text_update = now
+    
+    try:
+        result = fetch_episode_files(_series_data, base_url, api_key, timeout, show_progress)
+    finally:
+        progress_bar.empty()
+        status_text.empty()
+    
+    _, error, warning = result
+    if error or warning:
+        # Raised results are not cached, so the next run retries the failed requests
+        raise _UncachedResult(result)
+    
+    return result
+
+
+def fetch_all_episode_files(
+    series_data: List[Dict],
+    base_url: str,
+    api_key: str,
+    timeout: int,
+    cache_key: Tuple[int, ...]
+) -> Tuple[Optional[pd.DataFrame], Optional[str], Optional[str]]:
+    """
+    Fetch episode files for all series, caching only complete results.
+    
+    Returns:
+        Tuple of (episode file DataFrame or None, error, warning about skipped series)
+    """
+    try:
+        return _fetch_complete_episode_files(series_data, base_url, api_key, timeout, cache_key)
+    except _UncachedResult as e:
+        return e.result
 
 
 def compute_metrics(
@@ -255,23 +231,26 @@ def compute_metrics(
     episodefile_df: pd.DataFrame
 ) -> pd.DataFrame:
     """Compute size metrics for each series."""
-    series_stats = episodefile_df.groupby('series_id').agg(
-        episode_count=('episode_file_id', 'count'),
-        total_size_bytes=('size_bytes', 'sum')
-    ).reset_index()
-    
-    series_stats['total_size_gb'] = series_stats['total_size_bytes'] / (1024**3)
-    series_stats['avg_size_mb'] = (
-        series_stats['total_size_bytes'] / series_stats['episode_count']
-    ) / (1024**2)
-    
-    analysis_df = series_df.merge(series_stats, on='series_id', how='left')
-    
-    analysis_df['episode_count'] = analysis_df['episode_count'].fillna(0).astype(int)
-    analysis_df['total_size_gb'] = analysis_df['total_size_gb'].fillna(0)
-    analysis_df['avg_size_mb'] = analysis_df['avg_size_mb'].fillna(0)
+    codes, series_ids = pd.factorize(episodefile_df['series_id'], sort=False)
+    counts = np.bincount(codes)
+    sums = np.bincount(codes, weights=episodefile_df['size_bytes'].to_numpy(np.float64))
+    
+    series_stats = pd.DataFrame({
+        'episode_count': counts.astype(np.int32, copy=False),
+        'total_size_bytes': sums,
+        'total_size_gb': sums / (1024**3),
+        'avg_size_mb': sums / counts / (1024**2)
+    }, index=pd.Index(series_ids, name='series_id'))
+    
+    # Inner join: series without episode files have no stats row and drop out
+    analysis_df = (
+        series_df.set_index('series_id')
+        .join(series_stats, how='inner')
+        .reset_index()
+    )
     
-    analysis_df = analysis_df[analysis_df['episode_count'] > 0].copy()
+    # Arrow-backed strings hand over to st.dataframe without an object conversion
+    analysis_df = analysis_df.astype({'title': 'string[pyarrow]', 'status': 'string[pyarrow]'})
     
     return analysis_df
 
@@ -285,28 +264,45 @@ def detect_outliers(
     if len(df) == 0:
         return df, {}
     
-    mean_size = df['avg_size_mb'].mean()
-    std_size = df['avg_size_mb'].std()
+    values = df['avg_size_mb'].to_numpy(np.float64)
+    mean_size = values.mean()
+    # Sample std (ddof=1), matching the statistics already stored in history
+    std_size = values.std(ddof=1) if len(values) > 1 else np.nan
     
-    df['z_score'] = (df['avg_size_mb'] - mean_size) / std_size if std_size > 0 else 0
+    if std_size > 0:
+        z_scores = (values - mean_size) / std_size
+    else:
+        z_scores = np.zeros_like(values)
     
     z_outlier_threshold = mean_size + z_threshold * std_size
-    df['is_outlier'] = df['avg_size_mb'] > z_outlier_threshold
+    is_outlier = values > z_outlier_threshold
     
     if absolute_threshold is not None:
-        df['is_outlier'] = df['is_outlier'] | (df['avg_size_mb'] > absolute_threshold)
+        is_outlier |= values > absolute_threshold
+    
+    df = df.assign(z_score=z_scores, is_outlier=is_outlier)
+    outlier_count = int(np.count_nonzero(is_outlier))
     
     stats = {
         'mean': mean_size,
         'std': std_size,
         'z_threshold': z_outlier_threshold,
-        'outlier_count': int(df['is_outlier'].sum()),
-        'outlier_percentage': (df['is_outlier'].sum() / len(df) * 100) if len(df) > 0 else 0
+        'outlier_count': outlier_count,
+        'outlier_percentage': outlier_count / len(df) * 100
     }
     
     return df, stats
 
 
+def _top_n_indices(values: np.ndarray, n: int) -> np.ndarray:
+    """Positions of the n largest values, largest first, without a full sort."""
+    if len(values) <= n:
+        return np.argsort(-values, kind='stable')
+    
+    idx = np.argpartition(-values, n)[:n]
+    return idx[np.argsort(-values[idx], kind='stable')]
+
+
 # ============================================================================
 # FIRST RUN: CREATE ADMIN PAGE
 # ============================================================================
@@ -692,17 +688,25 @@ def show_analysis_page():
                     for s in series_data
                 ])
                 
-                episodefile_df, error = fetch_all_episode_files(
+                series_ids = tuple(sorted(
+                    s['id'] for s in series_data if s.get('id') is not None
+                ))
+                
+                episodefile_df, error, warning = fetch_all_episode_files(
                     series_data,
                     sonarr_url,
                     api_key,
-                    timeout
+                    timeout,
+                    cache_key=series_ids
                 )
                 
                 if error:
                     st.error(error)
                     return
                 
+                if warning:
+                    st.warning(warning)
+                
                 st.success(f"✅ Found {len(episodefile_df)} episode files")
             
             # Compute metrics
@@ -721,7 +725,7 @@ def show_analysis_page():
             
             # Save to history if requested
             if save_to_history:
-                success, msg = st.session_state.history_db.save_analysis(
+                success, msg = get_history_db().save_analysis(
                     user_id,
                     analysis_df,
                     stats,
@@ -736,6 +740,9 @@ def show_analysis_page():
             # Store in session state
             st.session_state['analysis_df'] = analysis_df
             st.session_state['stats'] = stats
+            # Sidebar scalars, refreshed whenever analysis_df is replaced
+            st.session_state['analysis_series_count'] = len(analysis_df)
+            st.session_state['analysis_total_gb'] = float(analysis_df['total_size_gb'].sum())
             st.session_state['analysis_date'] = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
             
             st.success("✅ Analysis complete!")
@@ -788,28 +795,29 @@ def display_analysis_results():
     
     with tab1:
         st.subheader("Series Analysis Table")
-        display_df = analysis_df[[
-            'title', 'episode_count', 'total_size_gb', 'avg_size_mb', 'z_score', 'is_outlier'
-        ]].copy()
-        
-        # Format to 2 decimal places
-        display_df['total_size_gb'] = display_df['total_size_gb'].round(2)
-        display_df['avg_size_mb'] = display_df['avg_size_mb'].round(2)
-        display_df['z_score'] = display_df['z_score'].round(2)
-        
-        display_df.columns = [
-            'Series Title', 'Episodes', 'Total Size (GB)',
-            'Avg Size (MB)', 'Z-Score', 'Outlier'
-        ]
-        
-        display_df = display_df.sort_values('Avg Size (MB)', ascending=False)
+        # Format to 2 decimal places; each step returns a new frame, so no explicit copy
+        display_df = (
+            analysis_df.loc[:, [
+                'title', 'episode_count', 'total_size_gb', 'avg_size_mb', 'z_score', 'is_outlier'
+            ]]
+            .round({'total_size_gb': 2, 'avg_size_mb': 2, 'z_score': 2})
+            .rename(columns={
+                'title': 'Series Title',
+                'episode_count': 'Episodes',
+                'total_size_gb': 'Total Size (GB)',
+                'avg_size_mb': 'Avg Size (MB)',
+                'z_score': 'Z-Score',
+                'is_outlier': 'Outlier'
+            }, copy=False)
+            .sort_values('Avg Size (MB)', ascending=False, kind='stable')
+        )
         st.dataframe(display_df, use_container_width=True, height=400)
     
     with tab2:
         # Bar chart
         st.subheader("Top 20 Series by Average Size")
-        top_20 = analysis_df.nlargest(20, 'avg_size_mb')
-        colors = ['#e74c3c' if outlier else '#3498db' for outlier in top_20['is_outlier']]
+        top_20 = analysis_df.iloc[_top_n_indices(analysis_df['avg_size_mb'].to_numpy(), 20)]
+        colors = np.where(top_20['is_outlier'].to_numpy(), '#e74c3c', '#3498db').tolist()
         
         fig = go.Figure(go.Bar(
             y=top_20['title'],
@@ -835,21 +843,96 @@ def display_analysis_results():
         if len(outliers) > 0:
             st.warning(f"Found {len(outliers)} series with unusually high file sizes")
             
-            for idx, (i, row) in enumerate(outliers.head(10).iterrows(), 1):
-                with st.expander(f"#{idx} - {row['title']} ({row['avg_size_mb']:.2f} MB/episode)"):
+            top_outliers = outliers.head(10)[[
+                'title', 'episode_count', 'total_size_gb', 'avg_size_mb', 'z_score'
+            ]]
+            
+            for idx, row in enumerate(top_outliers.itertuples(index=False), 1):
+                with st.expander(f"#{idx} - {row.title} ({row.avg_size_mb:.2f} MB/episode)"):
                     col1, col2 = st.columns(2)
                     
                     with col1:
-                        st.write(f"**Episodes:** {row['episode_count']}")
-                        st.write(f"**Total Size:** {row['total_size_gb']:.2f} GB")
+                        st.write(f"**Episodes:** {row.episode_count}")
+                        st.write(f"**Total Size:** {row.total_size_gb:.2f} GB")
                     
                     with col2:
-                        st.write(f"**Avg Size:** {row['avg_size_mb']:.2f} MB")
-                        st.write(f"**Z-Score:** {row['z_score']:.2f}")
+                        st.write(f"**Avg Size:** {row.avg_size_mb:.2f} MB")
+                        st.write(f"**Z-Score:** {row.z_score:.2f}")
         else:
             st.success("✅ No outliers detected!")
 
 
+# ============================================================================
+# HISTORY DATA FUNCTIONS
+# ============================================================================
+
+# Streamlit reruns the whole script on every interaction; these wrappers keep
+# history reads out of SQLite until the user's history changes or the TTL
+# expires. The version argument is HistoryDatabase.data_version, counted on the
+# shared get_history_db() instance, so a write made in any session (or before a
+# page refresh) invalidates every session's entries. The database object itself
+# is not hashed (leading _).
+
+@st.cache_data(ttl=300, show_spinner=False)
+def cached_analysis_dates(_db: HistoryDatabase, db_path: str, user_id: int, version: int) -> List[str]:
+    """Cached HistoryDatabase.get_analysis_dates."""
+    return _db.get_analysis_dates(user_id)
+
+
+@st.cache_data(ttl=300, show_spinner=False)
+def cached_global_trends(_db: HistoryDatabase, db_path: str, user_id: int, version: int) -> Optional[pd.DataFrame]:
+    """Cached HistoryDatabase.get_global_trends."""
+    return _db.get_global_trends(user_id)
+
+
+@st.cache_data(ttl=300, show_spinner=False)
+def cached_series_titles(_db: HistoryDatabase, db_path: str, user_id: int, version: int) -> Dict[int, str]:
+    """Cached series_id -> title map built from HistoryDatabase.get_series_list."""
+    series_list = _db.get_series_list(user_id)
+    if series_list is None:
+        return {}
+    return dict(zip(series_list['series_id'].tolist(), series_list['series_title'].tolist()))
+
+
+@st.cache_data(ttl=300, show_spinner=False)
+def cached_compare_summary(
+    _db: HistoryDatabase,
+    db_path: str,
+    user_id: int,
+    date1: str,
+    date2: str,
+    version: int
+) -> Optional[Dict[str, float]]:
+    """Cached HistoryDatabase.compare_dates_summary."""
+    return _db.compare_dates_summary(user_id, date1, date2)
+
+
+@st.cache_data(ttl=300, show_spinner=False)
+def cached_compare_dates(
+    _db: HistoryDatabase,
+    db_path: str,
+    user_id: int,
+    date1: str,
+    date2: str,
+    version: int
+) -> Optional[pd.DataFrame]:
+    """Cached HistoryDatabase.compare_dates."""
+    return _db.compare_dates(user_id, date1, date2)
+
+
+@st.cache_data(ttl=300, show_spinner=False)
+def cached_time_series_multi(
+    _db: HistoryDatabase,
+    db_path: str,
+    user_id: int,
+    series_id: int,
+    metrics: Tuple[str, ...],
+    version: int
+) -> Optional[pd.DataFrame]:
+    """Cached HistoryDatabase.get_time_series_multi."""
+    return _db.get_time_series_multi(user_id, series_id, metrics)
+
+
 # ============================================================================
 # HISTORICAL ANALYSIS PAGE
 # ============================================================================
@@ -859,10 +942,10 @@ def show_history_page():
     st.title("📈 Historical Analysis")
     
     user_id = st.session_state.user['id']
-    db = st.session_state.history_db
+    db = get_history_db()
     
     # Get available dates for this user
-    available_dates = db.get_analysis_dates(user_id)
+    available_dates = cached_analysis_dates(db, str(db.db_path), user_id, db.data_version(user_id))
     
     if not available_dates:
         st.info("📭 No historical data available yet. Run an analysis first!")
@@ -870,20 +953,21 @@ def show_history_page():
     
     st.success(f"📊 Found {len(available_dates)} historical analyses")
     
-    # Tabs for different views
-    tab1, tab2, tab3, tab4 = st.tabs([
+    # Views: unlike st.tabs, only the selected branch runs on each rerun
+    views = [
         "📅 All Analyses",
         "🔄 Compare Dates",
         "📈 Trends",
         "⚙️ Manage Data"
-    ])
+    ]
+    view = st.radio("View", views, horizontal=True, label_visibility="collapsed", key="history_view")
     
-    # ========== TAB 1: All Analyses ==========
-    with tab1:
+    # ========== VIEW 1: All Analyses ==========
+    if view == views[0]:
         st.subheader("All Historical Analyses")
         
         # Load global trends
-        trends_df = db.get_global_trends(user_id)
+        trends_df = cached_global_trends(db, str(db.db_path), user_id, db.data_version(user_id))
         
         if trends_df is not None and len(trends_df) > 0:
             # Format numeric columns to 2 decimal places
@@ -900,19 +984,20 @@ def show_history_page():
             # Storage evolution chart
             st.subheader("Storage Evolution Over Time")
             
-            fig = go.Figure()
-            fig.add_trace(go.Scatter(
-                x=trends_df['analysis_date'],
-                y=trends_df['total_storage_gb'].round(2),
-                mode='lines+markers',
-                name='Total Storage (GB)',
-                line=dict(color='#3498db', width=3)
-            ))
-            
-            fig.update_layout(
-                xaxis_title="Date",
-                yaxis_title="Total Storage (GB)",
-                height=400
+            fig = go.Figure(
+                data=[go.Scattergl(
+                    x=trends_df['analysis_date'],
+                    y=trends_df['total_storage_gb'].round(2),
+                    mode='lines+markers',
+                    name='Total Storage (GB)',
+                    line=dict(color='#3498db', width=3)
+                )],
+                layout=dict(
+                    xaxis_title="Date",
+                    yaxis_title="Total Storage (GB)",
+                    height=400,
+                    uirevision='history'
+                )
             )
             
             st.plotly_chart(fig, use_container_width=True)
@@ -920,25 +1005,26 @@ def show_history_page():
             # Average size evolution
             st.subheader("Average Episode Size Evolution")
             
-            fig2 = go.Figure()
-            fig2.add_trace(go.Scatter(
-                x=trends_df['analysis_date'],
-                y=trends_df['mean_avg_size_mb'].round(2),
-                mode='lines+markers',
-                name='Mean Avg Size (MB)',
-                line=dict(color='#2ecc71', width=3)
-            ))
-            
-            fig2.update_layout(
-                xaxis_title="Date",
-                yaxis_title="Mean Average Size (MB)",
-                height=400
+            fig2 = go.Figure(
+                data=[go.Scattergl(
+                    x=trends_df['analysis_date'],
+                    y=trends_df['mean_avg_size_mb'].round(2),
+                    mode='lines+markers',
+                    name='Mean Avg Size (MB)',
+                    line=dict(color='#2ecc71', width=3)
+                )],
+                layout=dict(
+                    xaxis_title="Date",
+                    yaxis_title="Mean Average Size (MB)",
+                    height=400,
+                    uirevision='history'
+                )
             )
             
             st.plotly_chart(fig2, use_container_width=True)
     
-    # ========== TAB 2: Compare Dates ==========
-    with tab2:
+    # ========== VIEW 2: Compare Dates ==========
+    if view == views[1]:
         st.subheader("Compare Two Analyses")
         
         col1, col2 = st.columns(2)
@@ -963,130 +1049,137 @@ def show_history_page():
             if date1 == date2:
                 st.warning("Please select two different dates")
             else:
-                with st.spinner("Comparing analyses..."):
-                    comparison_df = db.compare_dates(user_id, date1, date2)
+                # Remember the pair so the results survive widget reruns
+                st.session_state['compared_dates'] = (date1, date2)
+        
+        if st.session_state.get('compared_dates') == (date1, date2):
+            with st.spinner("Comparing analyses..."):
+                summary = cached_compare_summary(
+                    db, str(db.db_path), user_id, date1, date2, db.data_version(user_id)
+                )
+            
+            if summary is None:
+                st.error("Failed to compare dates")
+            else:
+                # Summary metrics with 2 decimal places
+                st.subheader("Comparison Summary")
+                
+                col1, col2, col3, col4 = st.columns(4)
+                
+                total_change = summary['total_size_change_gb']
+                avg_change = summary['avg_size_change_mb']
+                
+                with col1:
+                    st.metric("New Series", summary['new_count'])
+                
+                with col2:
+                    st.metric("Removed Series", summary['removed_count'])
+                
+                with col3:
+                    st.metric(
+                        "Storage Change",
+                        f"{abs(total_change):.2f} GB",
+                        delta=f"{total_change:+.2f} GB",
+                        delta_color="inverse" if total_change < 0 else "normal"
+                    )
+                
+                with col4:
+                    st.metric(
+                        "Avg Size Change",
+                        f"{abs(avg_change):.2f} MB",
+                        delta=f"{avg_change:+.2f} MB"
+                    )
+            
+            # Per-series rows are only loaded when asked for
+            if summary is not None and st.toggle("Show detailed comparison", key="compare_details"):
+                comparison_df = cached_compare_dates(
+                    db, str(db.db_path), user_id, date1, date2, db.data_version(user_id)
+                )
+                
+                if comparison_df is None or len(comparison_df) == 0:
+                    st.error("Failed to compare dates")
+                else:
+                    # Detailed comparison table
+                    st.subheader("Detailed Comparison")
                     
-                    if comparison_df is None or len(comparison_df) == 0:
-                        st.error("Failed to compare dates")
-                    else:
-                        # Summary metrics with 2 decimal places
-                        st.subheader("Comparison Summary")
-                        
-                        col1, col2, col3, col4 = st.columns(4)
-                        
-                        new_series = len(comparison_df[comparison_df['status'] == 'new'])
-                        removed_series = len(comparison_df[comparison_df['status'] == 'removed'])
-                        total_change = comparison_df['size_change_gb'].sum()
-                        
-                        with col1:
-                            st.metric("New Series", new_series)
-                        
-                        with col2:
-                            st.metric("Removed Series", removed_series)
-                        
-                        with col3:
-                            st.metric(
-                                "Storage Change",
-                                f"{abs(total_change):.2f} GB",
-                                delta=f"{total_change:+.2f} GB",
-                                delta_color="inverse" if total_change < 0 else "normal"
-                            )
-                        
-                        with col4:
-                            avg_change = comparison_df[comparison_df['status'] == 'existing']['avg_size_change_mb'].mean()
-                            st.metric(
-                                "Avg Size Change",
-                                f"{abs(avg_change):.2f} MB",
-                                delta=f"{avg_change:+.2f} MB"
-                            )
-                        
-                        # Detailed comparison table
-                        st.subheader("Detailed Comparison")
-                        
-                        # Format display with 2 decimal places
-                        display_comp = comparison_df.copy()
-                        display_comp['episode_count_old'] = display_comp['episode_count_old'].fillna(0).astype(int)
-                        display_comp['episode_count_new'] = display_comp['episode_count_new'].fillna(0).astype(int)
-                        display_comp['size_change_gb'] = display_comp['size_change_gb'].round(2)
-                        display_comp['size_change_pct'] = display_comp['size_change_pct'].round(2)
-                        display_comp['avg_size_change_mb'] = display_comp['avg_size_change_mb'].round(2)
-                        
-                        st.dataframe(
-                            display_comp[[
-                                'series_title', 'status', 'episodes_change',
-                                'size_change_gb', 'size_change_pct', 'avg_size_change_mb'
-                            ]],
-                            use_container_width=True,
-                            height=400
-                        )
-                        
-                        # Top changers chart
-                        st.subheader("Top 10 Size Changes")
-                        
-                        top_changes = comparison_df.nlargest(10, 'size_change_gb') if len(comparison_df) > 10 else comparison_df
-                        
-                        fig = go.Figure()
-                        
-                        colors = ['#28a745' if x < 0 else '#dc3545' for x in top_changes['size_change_gb']]
-                        
-                        fig.add_trace(go.Bar(
+                    # Project the displayed columns first, then round them (2 decimals)
+                    display_comp = comparison_df[[
+                        'series_title', 'status', 'episodes_change',
+                        'size_change_gb', 'size_change_pct', 'avg_size_change_mb'
+                    ]].round({'size_change_gb': 2, 'size_change_pct': 2, 'avg_size_change_mb': 2})
+                    
+                    st.dataframe(
+                        display_comp,
+                        use_container_width=True,
+                        height=400
+                    )
+                    
+                    # Top changers chart
+                    st.subheader("Top 10 Size Changes")
+                    
+                    # Largest changes in either direction (growth and shrinkage)
+                    top_changes = comparison_df.iloc[
+                        _top_n_indices(np.abs(comparison_df['size_change_gb'].to_numpy()), 10)
+                    ]
+                    
+                    colors = np.where(
+                        top_changes['size_change_gb'].to_numpy() < 0, '#28a745', '#dc3545'
+                    ).tolist()
+                    size_change = top_changes['size_change_gb'].round(2)
+                    
+                    fig = go.Figure(
+                        data=[go.Bar(
                             y=top_changes['series_title'],
-                            x=top_changes['size_change_gb'].round(2),
+                            x=size_change,
                             orientation='h',
                             marker=dict(color=colors),
-                            text=top_changes['size_change_gb'].round(2),
+                            text=size_change,
                             textposition='outside'
-                        ))
-                        
-                        fig.update_layout(
+                        )],
+                        layout=dict(
                             xaxis_title="Size Change (GB)",
                             yaxis_title="",
                             height=500,
-                            yaxis={'categoryorder': 'total ascending'}
-                        )
-                        
-                        st.plotly_chart(fig, use_container_width=True)
-                        
-                        # Export comparison
-                        csv_data = comparison_df.to_csv(index=False).encode('utf-8')
-                        st.download_button(
-                            label="📥 Download Comparison CSV",
-                            data=csv_data,
-                            file_name=f"comparison_{date1[:10]}_vs_{date2[:10]}.csv",
-                            mime="text/csv"
+                            yaxis={'categoryorder': 'total ascending'},
+                            uirevision='history'
                         )
+                    )
+                    
+                    st.plotly_chart(fig, use_container_width=True)
+                    
+                    # Export comparison
+                    csv_data = dataframe_to_csv_bytes(comparison_df)
+                    st.download_button(
+                        label="📥 Download Comparison CSV",
+                        data=csv_data,
+                        file_name=f"comparison_{date1[:10]}_vs_{date2[:10]}.csv",
+                        mime="text/csv"
+                    )
     
-    # ========== TAB 3: Trends ==========
-    with tab3:
+    # ========== VIEW 3: Trends ==========
+    if view == views[2]:
         st.subheader("Series Trends Over Time")
         
         # Select a specific series to track
         # First, get a list of all series that appear in history
-        import sqlite3
-        conn = sqlite3.connect(db.db_path)
-        series_list = pd.read_sql_query("""
-            SELECT DISTINCT series_id, series_title 
-            FROM history 
-            WHERE user_id = ?
-            ORDER BY series_title
-        """, conn, params=(user_id,))
-        conn.close()
+        title_map = cached_series_titles(db, str(db.db_path), user_id, db.data_version(user_id))
         
-        if len(series_list) > 0:
+        if title_map:
             selected_series = st.selectbox(
                 "Select series to track",
-                options=series_list['series_id'].tolist(),
-                format_func=lambda x: series_list[series_list['series_id'] == x]['series_title'].iloc[0]
+                options=list(title_map),
+                format_func=title_map.get
             )
             
             if st.button("📊 Show Trend"):
-                # Get time series for this series
-                ts_size = db.get_time_series(user_id, selected_series, 'total_size_gb')
-                ts_episodes = db.get_time_series(user_id, selected_series, 'episode_count')
-                ts_avg = db.get_time_series(user_id, selected_series, 'avg_size_mb')
+                # Get all three metrics for this series in one query
+                ts = cached_time_series_multi(
+                    db, str(db.db_path), user_id, selected_series,
+                    ('total_size_gb', 'episode_count', 'avg_size_mb'), db.data_version(user_id)
+                )
                 
-                if ts_size is not None and len(ts_size) > 0:
-                    series_name = ts_size['series_title'].iloc[0]
+                if ts is not None and len(ts) > 0:
+                    series_name = ts['series_title'].iloc[0]
                     
                     st.subheader(f"Trend for: {series_name}")
                     
@@ -1100,20 +1193,20 @@ def show_history_page():
                     )
                     
                     fig.add_trace(
-                        go.Scatter(x=ts_size['analysis_date'], y=ts_size['total_size_gb'].round(2),
-                                 mode='lines+markers', name='Total Size'),
+                        go.Scattergl(x=ts['analysis_date'], y=ts['total_size_gb'].round(2),
+                                     mode='lines+markers', name='Total Size'),
                         row=1, col=1
                     )
                     
                     fig.add_trace(
-                        go.Scatter(x=ts_episodes['analysis_date'], y=ts_episodes['episode_count'],
-                                 mode='lines+markers', name='Episodes'),
+                        go.Scattergl(x=ts['analysis_date'], y=ts['episode_count'],
+                                     mode='lines+markers', name='Episodes'),
                         row=2, col=1
                     )
                     
                     fig.add_trace(
-                        go.Scatter(x=ts_avg['analysis_date'], y=ts_avg['avg_size_mb'].round(2),
-                                 mode='lines+markers', name='Avg Size'),
+                        go.Scattergl(x=ts['analysis_date'], y=ts['avg_size_mb'].round(2),
+                                     mode='lines+markers', name='Avg Size'),
                         row=3, col=1
                     )
                     
@@ -1125,8 +1218,8 @@ def show_history_page():
         else:
             st.info("No series data in history yet")
     
-    # ========== TAB 4: Manage Data ==========
-    with tab4:
+    # ========== VIEW 4: Manage Data ==========
+    if view == views[3]:
         st.subheader("Manage Historical Data")
         
         # Only admins can delete data
@@ -1181,20 +1274,20 @@ def show_history_page():
         
         if st.button("📥 Export History to CSV"):
             timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-            output_path = f"sonarr_history_export_{timestamp}.csv"
             
-            success, msg = db.export_to_csv(user_id, output_path)
+            # Export straight into memory; nothing is written to disk
+            buf = io.BytesIO()
+            success, msg = db.export_to_csv(user_id, buf)
             
             if success:
                 st.success(msg)
                 
-                with open(output_path, 'rb') as f:
-                    st.download_button(
-                        label="Download Export",
-                        data=f,
-                        file_name=output_path,
-                        mime="text/csv"
-                    )
+                st.download_button(
+                    label="Download Export",
+                    data=buf.getvalue(),
+                    file_name=f"sonarr_history_export_{timestamp}.csv",
+                    mime="text/csv"
+                )
             else:
                 st.error(msg)
 
@@ -1250,13 +1343,12 @@ def main():
         # Quick stats if available
         if st.session_state.get('analysis_df') is not None:
             st.markdown("### Last Analysis")
-            df = st.session_state['analysis_df']
-            st.metric("Series", len(df))
-            st.metric("Storage", f"{df['total_size_gb'].sum():.2f} GB")
+            st.metric("Series", st.session_state['analysis_series_count'])
+            st.metric("Storage", f"{st.session_state['analysis_total_gb']:.2f} GB")
         
         # Database info
-        db = st.session_state.history_db
-        dates = db.get_analysis_dates(user['id'])
+        db = get_history_db()
+        dates = cached_analysis_dates(db, str(db.db_path), user['id'], db.data_version(user['id']))
         if dates:
             st.markdown("---")
             st.markdown("### Historical Data")
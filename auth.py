@@ -6,22 +6,109 @@ Supports admin and read-only user roles with secure password hashing.
 import sqlite3
 import hashlib
 import secrets
+import os
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
 from pathlib import Path
-from typing import Optional, Tuple, List, Dict
+from typing import Optional, Tuple, List, Dict, Iterator
 from datetime import datetime
 import bcrypt
 
+# Test runs (SONARR_ANALYZER_TEST_MODE=1) trade durability for speed: no fsync
+# and an in-memory rollback journal instead of WAL
+TEST_MODE = os.environ.get("SONARR_ANALYZER_TEST_MODE") == "1"
+
+# bcrypt work factor for new hashes; each step doubles hashing time.
+# BCRYPT_ROUNDS overrides it (the test suite lowers it to the minimum of 4)
+DEFAULT_BCRYPT_ROUNDS = int(os.environ.get("BCRYPT_ROUNDS", 12))
+
+# In-process user lookup cache: entries expire after USER_CACHE_TTL seconds and
+# the least recently used are evicted beyond USER_CACHE_SIZE. Cached users hold
+# no password hash and misses are not cached, so only writes that change or
+# remove a cached field (login, deletion) drop that user's entries
+USER_CACHE_TTL = 60
+USER_CACHE_SIZE = 1024
+
+# Hot-path SQL, kept as identical strings so the connection's statement cache reuses them
+SQL_HAS_USERS = "SELECT EXISTS(SELECT 1 FROM users)"
+SQL_HAS_ADMIN = "SELECT EXISTS(SELECT 1 FROM users WHERE role = 'admin')"
+SQL_COUNT_OTHER_ADMINS = "SELECT COUNT(*) FROM users WHERE role = 'admin' AND id != ?"
+SQL_USER_ID_BY_NAME = "SELECT id FROM users WHERE username = ?"
+SQL_USER_ROLE_BY_ID = "SELECT role FROM users WHERE id = ?"
+SQL_GET_AUTH_BY_NAME = "SELECT id, password_hash, is_active FROM users WHERE username = ?"
+# Column order of the user SELECTs below, mapped onto user dictionaries
+USER_COLUMNS = ('id', 'username', 'role', 'created_at', 'last_login', 'is_active')
+
+SQL_GET_USER_BY_ID = (
+    "SELECT id, username, role, created_at, last_login, is_active FROM users WHERE id = ?"
+)
+SQL_GET_USER_BY_NAME = (
+    "SELECT id, username, role, created_at, last_login, is_active FROM users WHERE username = ?"
+)
+SQL_LIST_USERS = (
+    "SELECT id, username, role, created_at, last_login, is_active FROM users ORDER BY created_at DESC"
+)
+# Returns the new user (USER_COLUMNS order), or no row if the username was
+# taken since the pre-check
+SQL_INSERT_USER = (
+    "INSERT INTO users (username, password_hash, role, created_at) VALUES (?, ?, ?, ?) "
+    "ON CONFLICT(username) DO NOTHING "
+    "RETURNING id, username, role, created_at, last_login, is_active"
+)
+# Records the login (and an optional re-hash) and returns the session fields in one
+# statement; matches nothing if the password changed after it was verified
+SQL_RECORD_LOGIN = (
+    "UPDATE users SET last_login = ?, password_hash = COALESCE(?, password_hash) "
+    "WHERE id = ? AND password_hash = ? RETURNING id, username, role"
+)
+# Bulk insert has no conflict clause: a taken username fails the whole batch
+SQL_INSERT_USERS = (
+    "INSERT INTO users (username, password_hash, role, created_at) VALUES (?, ?, ?, ?)"
+)
+SQL_UPDATE_PASSWORD = "UPDATE users SET password_hash = ? WHERE id = ?"
+SQL_DELETE_USER = "DELETE FROM users WHERE id = ?"
+
+
+def _row_to_user(row: Tuple) -> Dict:
+    """
+    Build a user dictionary from a row ordered as USER_COLUMNS.
+    
+    Args:
+        row: Database row
+        
+    Returns:
+        User dictionary
+    """
+    # One dict literal: no zip, no second store to convert is_active
+    return {
+        'id': row[0],
+        'username': row[1],
+        'role': row[2],
+        'created_at': row[3],
+        'last_login': row[4],
+        'is_active': row[5] == 1
+    }
+
 
 class UserManager:
     """Manages user authentication and authorization with SQLite database."""
     
-    def __init__(self, db_path: str = "data/users.db"):
+    def __init__(self, db_path: str = "data/users.db", bcrypt_rounds: int = DEFAULT_BCRYPT_ROUNDS):
         """
         Initialize user manager.
         
         Args:
             db_path: Path to SQLite database file for user data
+            bcrypt_rounds: bcrypt cost factor (4-31) for new password hashes;
+                existing hashes with a different cost are re-hashed on login
         """
+        if not 4 <= bcrypt_rounds <= 31:
+            raise ValueError("bcrypt_rounds must be between 4 and 31")
+        
+        self.bcrypt_rounds = bcrypt_rounds
         self.db_path = Path(db_path)
         # Ensure parent directory exists with proper permissions
         try:
@@ -32,53 +119,175 @@ class UserManager:
                 f"Please ensure the data directory is writable by UID 1000 (appuser). "
                 f"For bind mounts, run: sudo chown -R 1000:1000 /path/to/data"
             ) from e
+        self._conn: Optional[sqlite3.Connection] = None
+        self._lock = threading.RLock()
+        self._user_cache: OrderedDict = OrderedDict()
+        self._cache_lock = threading.RLock()
+        self._dummy_hash: Optional[bytes] = None
         self._init_database()
     
+    def _connect(self) -> sqlite3.Connection:
+        """
+        Open a database connection with performance pragmas applied.
+        
+        Returns:
+            SQLite connection
+        """
+        conn = sqlite3.connect(self.db_path, check_same_thread=False)
+        conn.execute("PRAGMA synchronous=OFF" if TEST_MODE else "PRAGMA synchronous=NORMAL")
+        conn.execute("PRAGMA temp_store=MEMORY")
+        conn.execute("PRAGMA cache_size=-8000")
+        conn.execute("PRAGMA mmap_size=67108864")
+        conn.execute("PRAGMA wal_autocheckpoint=1000")
+        conn.execute("PRAGMA busy_timeout=5000")
+        return conn
+    
+    @contextmanager
+    def _connection(self):
+        """
+        Borrow the shared connection, opening it on first use.
+        
+        The connection stays open for the manager's lifetime so SQLite's page
+        cache stays warm; the lock serializes access across threads.
+        
+        Yields:
+            SQLite connection
+        """
+        with self._lock:
+            if self._conn is None:
+                self._conn = self._connect()
+            try:
+                yield self._conn
+            finally:
+                # Anything left uncommitted (errors, early returns) is discarded,
+                # as closing a per-call connection used to do
+                if self._conn.in_transaction:
+                    self._conn.rollback()
+    
+    def close(self):
+        """Close the shared database connection."""
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+    
+    def _cache_get(self, key: Tuple) -> Optional[Dict]:
+        """
+        Look up a cached user dictionary.
+        
+        Args:
+            key: ('id', user_id) or ('username', username)
+            
+        Returns:
+            Copy of the cached user dictionary, or None if missing or expired
+        """
+        with self._cache_lock:
+            entry = self._user_cache.get(key)
+            if entry is None:
+                return None
+            
+            expires_at, user = entry
+            if expires_at < time.monotonic():
+                del self._user_cache[key]
+                return None
+            
+            self._user_cache.move_to_end(key)
+            return dict(user)
+    
+    def _cache_put(self, user: Dict):
+        """
+        Cache a user dictionary under both its ID and username.
+        
+        Args:
+            user: User dictionary as returned by get_user
+        """
+        expires_at = time.monotonic() + USER_CACHE_TTL
+        with self._cache_lock:
+            for key in (('id', user['id']), ('username', user['username'])):
+                self._user_cache[key] = (expires_at, dict(user))
+                self._user_cache.move_to_end(key)
+            
+            while len(self._user_cache) > USER_CACHE_SIZE:
+                self._user_cache.popitem(last=False)
+    
+    def _cache_drop(self, user_id: int):
+        """
+        Drop one user's cached entries after a write to their row.
+        
+        Args:
+            user_id: User ID
+        """
+        with self._cache_lock:
+            for key in [k for k, (_, user) in self._user_cache.items() if user['id'] == user_id]:
+                del self._user_cache[key]
+    
+    def _invalidate_user_cache(self):
+        """Drop all cached users."""
+        with self._cache_lock:
+            self._user_cache.clear()
+    
     def _init_database(self):
         """Create user database tables if they don't exist."""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        
-        # Users table
-        cursor.execute("""
-            CREATE TABLE IF NOT EXISTS users (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                username TEXT UNIQUE NOT NULL,
-                password_hash TEXT NOT NULL,
-                role TEXT NOT NULL CHECK(role IN ('admin', 'readonly')),
-                created_at TEXT NOT NULL,
-                last_login TEXT,
-                is_active INTEGER DEFAULT 1
-            )
-        """)
-        
-        # User sessions table (for tracking active sessions)
-        cursor.execute("""
-            CREATE TABLE IF NOT EXISTS sessions (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                user_id INTEGER NOT NULL,
-                session_token TEXT UNIQUE NOT NULL,
-                created_at TEXT NOT NULL,
-                expires_at TEXT NOT NULL,
-                FOREIGN KEY (user_id) REFERENCES users (id)
-            )
-        """)
-        
-        # Create indexes
-        cursor.execute("""
-            CREATE INDEX IF NOT EXISTS idx_username 
-            ON users(username)
-        """)
-        
-        cursor.execute("""
-            CREATE INDEX IF NOT EXISTS idx_session_token 
-            ON sessions(session_token)
-        """)
-        
-        conn.commit()
-        conn.close()
-    
-    def _hash_password(self, password: str) -> str:
+        with self._connection() as conn:
+            cursor = conn.cursor()
+            
+            # WAL lets readers proceed during writes; the mode persists in the file
+            if TEST_MODE:
+                cursor.execute("PRAGMA journal_mode=MEMORY")
+            elif str(self.db_path) != ':memory:':
+                cursor.execute("PRAGMA journal_mode=WAL")
+            
+            # Users table
+            cursor.execute("""
+                CREATE TABLE IF NOT EXISTS users (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    username TEXT UNIQUE NOT NULL,
+                    password_hash BLOB NOT NULL,
+                    role TEXT NOT NULL CHECK(role IN ('admin', 'readonly')),
+                    created_at TEXT NOT NULL,
+                    last_login TEXT,
+                    is_active INTEGER DEFAULT 1
+                )
+            """)
+            
+            # User sessions table (for tracking active sessions)
+            cursor.execute("""
+                CREATE TABLE IF NOT EXISTS sessions (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    user_id INTEGER NOT NULL,
+                    session_token TEXT UNIQUE NOT NULL,
+                    created_at TEXT NOT NULL,
+                    expires_at TEXT NOT NULL,
+                    FOREIGN KEY (user_id) REFERENCES users (id)
+                )
+            """)
+            
+            # Hashes are stored as raw bcrypt bytes; convert rows written as text
+            cursor.execute("""
+                UPDATE users SET password_hash = CAST(password_hash AS BLOB)
+                WHERE typeof(password_hash) = 'text'
+            """)
+            
+            # Create indexes
+            cursor.execute("""
+                CREATE INDEX IF NOT EXISTS idx_username 
+                ON users(username)
+            """)
+            
+            # Partial index: admin checks only touch the (few) admin rows
+            cursor.execute("""
+                CREATE INDEX IF NOT EXISTS idx_admin
+                ON users(role) WHERE role = 'admin'
+            """)
+            
+            cursor.execute("""
+                CREATE INDEX IF NOT EXISTS idx_session_token 
+                ON sessions(session_token)
+            """)
+            
+            conn.commit()
+    
+    def _hash_password(self, password: str) -> bytes:
         """
         Hash password using bcrypt.
         
@@ -86,28 +295,56 @@ class UserManager:
             password: Plain text password
             
         Returns:
-            Hashed password string
+            Hashed password bytes, stored as-is in the database
         """
-        salt = bcrypt.gensalt(rounds=12)
-        hashed = bcrypt.hashpw(password.encode('utf-8'), salt)
-        return hashed.decode('utf-8')
+        salt = bcrypt.gensalt(rounds=self.bcrypt_rounds)
+        return bcrypt.hashpw(password.encode('utf-8'), salt)
     
-    def _verify_password(self, password: str, password_hash: str) -> bool:
+    def _verify_password(self, password: str, password_hash: bytes) -> bool:
         """
         Verify password against hash.
         
         Args:
             password: Plain text password to verify
-            password_hash: Stored password hash
+            password_hash: Stored password hash bytes
             
         Returns:
             True if password matches
         """
         try:
-            return bcrypt.checkpw(password.encode('utf-8'), password_hash.encode('utf-8'))
+            return bcrypt.checkpw(password.encode('utf-8'), password_hash)
         except Exception:
             return False
     
+    def _get_dummy_hash(self) -> bytes:
+        """
+        Get a throwaway hash at the configured cost, created on first use.
+        
+        Verifying against it when a username does not exist makes unknown
+        users cost as much as wrong passwords.
+        
+        Returns:
+            bcrypt hash bytes
+        """
+        if self._dummy_hash is None:
+            self._dummy_hash = self._hash_password(secrets.token_hex(16))
+        return self._dummy_hash
+    
+    def _needs_rehash(self, password_hash: bytes) -> bool:
+        """
+        Check whether a stored hash uses a different cost than configured.
+        
+        Args:
+            password_hash: Stored bcrypt hash (b'$2b$<cost>$...')
+            
+        Returns:
+            True if the hash should be regenerated
+        """
+        try:
+            return int(password_hash.split(b'$')[2]) != self.bcrypt_rounds
+        except (IndexError, ValueError):
+            return False
+    
     def has_users(self) -> bool:
         """
         Check if any users exist in the database.
@@ -116,14 +353,10 @@ class UserManager:
             True if at least one user exists
         """
         try:
-            conn = sqlite3.connect(self.db_path)
-            cursor = conn.cursor()
-            
-            cursor.execute("SELECT COUNT(*) FROM users")
-            count = cursor.fetchone()[0]
+            with self._connection() as conn:
+                exists = conn.execute(SQL_HAS_USERS).fetchone()[0]
             
-            conn.close()
-            return count > 0
+            return bool(exists)
         except Exception:
             return False
     
@@ -135,17 +368,39 @@ class UserManager:
             True if an admin exists
         """
         try:
-            conn = sqlite3.connect(self.db_path)
-            cursor = conn.cursor()
-            
-            cursor.execute("SELECT COUNT(*) FROM users WHERE role = 'admin'")
-            count = cursor.fetchone()[0]
+            with self._connection() as conn:
+                exists = conn.execute(SQL_HAS_ADMIN).fetchone()[0]
             
-            conn.close()
-            return count > 0
+            return bool(exists)
         except Exception:
             return False
     
+    def _validate_new_user(self, username: str, password: str, role: str) -> Optional[str]:
+        """
+        Check the fields of a user about to be created.
+        
+        Args:
+            username: Username
+            password: Plain text password
+            role: User role
+            
+        Returns:
+            Error message, or None if the fields are valid
+        """
+        if not username or not password:
+            return "Username and password cannot be empty"
+        
+        if len(username) < 3:
+            return "Username must be at least 3 characters"
+        
+        if len(password) < 8:
+            return "Password must be at least 8 characters"
+        
+        if role not in ['admin', 'readonly']:
+            return "Role must be 'admin' or 'readonly'"
+        
+        return None
+    
     def create_user(
         self,
         username: str,
@@ -163,45 +418,109 @@ class UserManager:
         Returns:
             Tuple of (success, message)
         """
+        success, _, msg = self.create_user_and_get(username, password, role)
+        return success, msg
+    
+    def create_user_and_get(
+        self,
+        username: str,
+        password: str,
+        role: str = 'readonly'
+    ) -> Tuple[bool, Optional[Dict], str]:
+        """
+        Create a new user and return it, read back by the INSERT itself.
+        
+        Args:
+            username: Username (must be unique)
+            password: Plain text password (will be hashed)
+            role: User role ('admin' or 'readonly')
+            
+        Returns:
+            Tuple of (success, user_dict, message)
+        """
         try:
             # Validate inputs
-            if not username or not password:
-                return False, "Username and password cannot be empty"
+            error = self._validate_new_user(username, password, role)
+            if error:
+                return False, None, error
             
-            if len(username) < 3:
-                return False, "Username must be at least 3 characters"
+            # Check if username exists
+            with self._connection() as conn:
+                if conn.execute(SQL_USER_ID_BY_NAME, (username,)).fetchone():
+                    return False, None, "Username already exists"
             
-            if len(password) < 8:
-                return False, "Password must be at least 8 characters"
+            # Hash password without holding the connection
+            password_hash = self._hash_password(password)
             
-            if role not in ['admin', 'readonly']:
-                return False, "Role must be 'admin' or 'readonly'"
+            # Insert user
+            with self._connection() as conn:
+                row = conn.execute(
+                    SQL_INSERT_USER,
+                    (username, password_hash, role, datetime.now().isoformat())
+                ).fetchone()
+                
+                if not row:
+                    return False, None, "Username already exists"
+                
+                conn.commit()
+            
+            user = _row_to_user(row)
+            self._cache_put(user)
+            
+            return True, user, f"User '{username}' created successfully with {role} role"
             
-            # Check if username exists
-            conn = sqlite3.connect(self.db_path)
-            cursor = conn.cursor()
+        except Exception as e:
+            return False, None, f"Error creating user: {str(e)}"
+    
+    def create_users_bulk(self, users: List[Tuple[str, str, str]]) -> Tuple[bool, str]:
+        """
+        Create many users at once, all or nothing.
+        
+        Hashes are computed on a thread pool like bulk_update_passwords, and
+        all rows are inserted in a single transaction.
+        
+        Args:
+            users: List of (username, password, role) tuples
             
-            cursor.execute("SELECT id FROM users WHERE username = ?", (username,))
-            if cursor.fetchone():
-                conn.close()
+        Returns:
+            Tuple of (success, message)
+        """
+        try:
+            if not users:
+                return True, "No users to create"
+            
+            for username, password, role in users:
+                error = self._validate_new_user(username, password, role)
+                if error:
+                    return False, error
+            
+            usernames = [username for username, _, _ in users]
+            if len(set(usernames)) != len(usernames):
                 return False, "Username already exists"
             
-            # Hash password
-            password_hash = self._hash_password(password)
+            with self._connection() as conn:
+                if any(conn.execute(SQL_USER_ID_BY_NAME, (u,)).fetchone() for u in usernames):
+                    return False, "Username already exists"
             
-            # Insert user
-            cursor.execute("""
-                INSERT INTO users (username, password_hash, role, created_at)
-                VALUES (?, ?, ?, ?)
-            """, (username, password_hash, role, datetime.now().isoformat()))
+            with ThreadPoolExecutor(max_workers=os.cpu_count()) as executor:
+                hashes = list(executor.map(self._hash_password, [p for _, p, _ in users]))
             
-            conn.commit()
-            conn.close()
+            created_at = datetime.now().isoformat()
+            with self._connection() as conn:
+                try:
+                    conn.executemany(
+                        SQL_INSERT_USERS,
+                        [(username, password_hash, role, created_at)
+                         for (username, _, role), password_hash in zip(users, hashes)]
+                    )
+                except sqlite3.IntegrityError:
+                    return False, "Username already exists"
+                conn.commit()
             
-            return True, f"User '{username}' created successfully with {role} role"
+            return True, f"Created {len(users)} users"
             
         except Exception as e:
-            return False, f"Error creating user: {str(e)}"
+            return False, f"Error creating users: {str(e)}"
     
     def authenticate(
         self,
@@ -219,46 +538,46 @@ class UserManager:
             Tuple of (success, user_dict, message)
         """
         try:
-            conn = sqlite3.connect(self.db_path)
-            cursor = conn.cursor()
-            
-            cursor.execute("""
-                SELECT id, username, password_hash, role, is_active
-                FROM users
-                WHERE username = ?
-            """, (username,))
-            
-            row = cursor.fetchone()
+            with self._connection() as conn:
+                row = conn.execute(SQL_GET_AUTH_BY_NAME, (username,)).fetchone()
             
+            # bcrypt runs outside the connection lock so other threads can use it
             if not row:
-                conn.close()
+                # Same bcrypt cost as a wrong password, so timing doesn't reveal usernames
+                self._verify_password(password, self._get_dummy_hash())
                 return False, None, "Invalid username or password"
             
-            user_id, username, password_hash, role, is_active = row
+            user_id, password_hash, is_active = row
             
             if not is_active:
-                conn.close()
                 return False, None, "User account is disabled"
             
             # Verify password
             if not self._verify_password(password, password_hash):
-                conn.close()
                 return False, None, "Invalid username or password"
             
-            # Update last login
-            cursor.execute("""
-                UPDATE users 
-                SET last_login = ?
-                WHERE id = ?
-            """, (datetime.now().isoformat(), user_id))
+            # Transparently move the hash to the configured cost
+            new_hash = self._hash_password(password) if self._needs_rehash(password_hash) else None
             
-            conn.commit()
-            conn.close()
+            with self._connection() as conn:
+                # Update last login and read back the user in the same statement
+                row = conn.execute(
+                    SQL_RECORD_LOGIN,
+                    (datetime.now().isoformat(), new_hash, user_id, password_hash)
+                ).fetchone()
+                
+                if not row:
+                    return False, None, "Invalid username or password"
+                
+                conn.commit()
+            
+            # last_login changed
+            self._cache_drop(user_id)
             
             user_dict = {
-                'id': user_id,
-                'username': username,
-                'role': role
+                'id': row[0],
+                'username': row[1],
+                'role': row[2]
             }
             
             return True, user_dict, "Authentication successful"
@@ -276,30 +595,21 @@ class UserManager:
         Returns:
             User dictionary or None
         """
+        cached = self._cache_get(('id', user_id))
+        if cached is not None:
+            return cached
+        
         try:
-            conn = sqlite3.connect(self.db_path)
-            cursor = conn.cursor()
-            
-            cursor.execute("""
-                SELECT id, username, role, created_at, last_login, is_active
-                FROM users
-                WHERE id = ?
-            """, (user_id,))
-            
-            row = cursor.fetchone()
-            conn.close()
+            with self._connection() as conn:
+                row = conn.execute(SQL_GET_USER_BY_ID, (user_id,)).fetchone()
             
             if not row:
                 return None
             
-            return {
-                'id': row[0],
-                'username': row[1],
-                'role': row[2],
-                'created_at': row[3],
-                'last_login': row[4],
-                'is_active': row[5] == 1
-            }
+            user = _row_to_user(row)
+            self._cache_put(user)
+            
+            return user
             
         except Exception:
             return None
@@ -314,30 +624,21 @@ class UserManager:
         Returns:
             User dictionary or None
         """
+        cached = self._cache_get(('username', username))
+        if cached is not None:
+            return cached
+        
         try:
-            conn = sqlite3.connect(self.db_path)
-            cursor = conn.cursor()
-            
-            cursor.execute("""
-                SELECT id, username, role, created_at, last_login, is_active
-                FROM users
-                WHERE username = ?
-            """, (username,))
-            
-            row = cursor.fetchone()
-            conn.close()
+            with self._connection() as conn:
+                row = conn.execute(SQL_GET_USER_BY_NAME, (username,)).fetchone()
             
             if not row:
                 return None
             
-            return {
-                'id': row[0],
-                'username': row[1],
-                'role': row[2],
-                'created_at': row[3],
-                'last_login': row[4],
-                'is_active': row[5] == 1
-            }
+            user = _row_to_user(row)
+            self._cache_put(user)
+            
+            return user
             
         except Exception:
             return None
@@ -350,32 +651,44 @@ class UserManager:
             List of user dictionaries
         """
         try:
-            conn = sqlite3.connect(self.db_path)
-            cursor = conn.cursor()
-            
-            cursor.execute("""
-                SELECT id, username, role, created_at, last_login, is_active
-                FROM users
-                ORDER BY created_at DESC
-            """)
+            with self._connection() as conn:
+                users = [_row_to_user(row) for row in conn.execute(SQL_LIST_USERS)]
             
-            users = []
-            for row in cursor.fetchall():
-                users.append({
-                    'id': row[0],
-                    'username': row[1],
-                    'role': row[2],
-                    'created_at': row[3],
-                    'last_login': row[4],
-                    'is_active': row[5] == 1
-                })
-            
-            conn.close()
             return users
             
         except Exception:
             return []
     
+    def iter_users(self, batch_size: int = 1000) -> Iterator[Dict]:
+        """
+        Stream all users without materializing the full list.
+        
+        The connection lock is held only while each batch is fetched, so
+        other callers are not blocked while the caller consumes rows.
+        
+        Args:
+            batch_size: Rows fetched per round trip
+            
+        Yields:
+            User dictionaries, in list_users order
+        """
+        try:
+            with self._connection() as conn:
+                cursor = conn.execute(SQL_LIST_USERS)
+            
+            while True:
+                with self._lock:
+                    rows = cursor.fetchmany(batch_size)
+                
+                if not rows:
+                    return
+                
+                for row in rows:
+                    yield _row_to_user(row)
+                    
+        except Exception:
+            return
+    
     def update_password(
         self,
         user_id: int,
@@ -397,64 +710,83 @@ class UserManager:
             
             password_hash = self._hash_password(new_password)
             
-            conn = sqlite3.connect(self.db_path)
-            cursor = conn.cursor()
-            
-            cursor.execute("""
-                UPDATE users 
-                SET password_hash = ?
-                WHERE id = ?
-            """, (password_hash, user_id))
-            
-            if cursor.rowcount == 0:
-                conn.close()
-                return False, "User not found"
-            
-            conn.commit()
-            conn.close()
+            with self._connection() as conn:
+                cursor = conn.execute(SQL_UPDATE_PASSWORD, (password_hash, user_id))
+                
+                if cursor.rowcount == 0:
+                    return False, "User not found"
+                
+                conn.commit()
             
             return True, "Password updated successfully"
             
         except Exception as e:
             return False, f"Error updating password: {str(e)}"
     
-    def delete_user(self, user_id: int) -> Tuple[bool, str]:
+    def bulk_update_passwords(self, updates: List[Tuple[int, str]]) -> Tuple[bool, str]:
         """
-        Delete a user.
+        Update many user passwords at once, e.g. for a forced rotation.
+        
+        bcrypt releases the GIL, so hashes are computed on a thread pool;
+        all rows are then written in a single transaction.
         
         Args:
-            user_id: User ID to delete
+            updates: List of (user_id, new_password) tuples
             
         Returns:
             Tuple of (success, message)
         """
         try:
-            conn = sqlite3.connect(self.db_path)
-            cursor = conn.cursor()
-            
-            # Check if this is the last admin
-            cursor.execute("""
-                SELECT COUNT(*) FROM users 
-                WHERE role = 'admin' AND id != ?
-            """, (user_id,))
+            if not updates:
+                return True, "No passwords to update"
             
-            admin_count = cursor.fetchone()[0]
+            if any(len(password) < 8 for _, password in updates):
+                return False, "Password must be at least 8 characters"
             
-            cursor.execute("SELECT role FROM users WHERE id = ?", (user_id,))
-            user = cursor.fetchone()
+            with ThreadPoolExecutor(max_workers=os.cpu_count()) as executor:
+                hashes = list(executor.map(self._hash_password, [p for _, p in updates]))
             
-            if user and user[0] == 'admin' and admin_count == 0:
-                conn.close()
-                return False, "Cannot delete the last admin user"
+            with self._connection() as conn:
+                cursor = conn.executemany(
+                    SQL_UPDATE_PASSWORD,
+                    zip(hashes, [user_id for user_id, _ in updates])
+                )
+                updated = cursor.rowcount
+                conn.commit()
             
-            cursor.execute("DELETE FROM users WHERE id = ?", (user_id,))
+            return True, f"Updated {updated} of {len(updates)} passwords"
             
-            if cursor.rowcount == 0:
-                conn.close()
-                return False, "User not found"
+        except Exception as e:
+            return False, f"Error updating passwords: {str(e)}"
+    
+    def delete_user(self, user_id: int) -> Tuple[bool, str]:
+        """
+        Delete a user.
+        
+        Args:
+            user_id: User ID to delete
             
-            conn.commit()
-            conn.close()
+        Returns:
+            Tuple of (success, message)
+        """
+        try:
+            with self._connection() as conn:
+                # Check if this is the last admin
+                admin_count = conn.execute(SQL_COUNT_OTHER_ADMINS, (user_id,)).fetchone()[0]
+                
+                user = conn.execute(SQL_USER_ROLE_BY_ID, (user_id,)).fetchone()
+                
+                if user and user[0] == 'admin' and admin_count == 0:
+                    return False, "Cannot delete the last admin user"
+                
+                cursor = conn.execute(SQL_DELETE_USER, (user_id,))
+                
+                if cursor.rowcount == 0:
+                    return False, "User not found"
+                
+                conn.commit()
+            
+            self._cache_drop(user_id)
             
             return True, "User deleted successfully"
             
@@ -4,12 +4,61 @@ Uses Fernet symmetric encryption (AES-128) with a master encryption key.
 """
 
 import os
-import json
 import base64
+import functools
 import sqlite3
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
 from pathlib import Path
-from typing import Optional, Tuple, Dict
+from datetime import datetime
+from typing import Optional, Tuple, Dict, List
 from cryptography.fernet import Fernet, InvalidToken
+import orjson
+
+# Test runs (SONARR_ANALYZER_TEST_MODE=1) trade durability for speed: no fsync
+# and an in-memory rollback journal instead of WAL
+TEST_MODE = os.environ.get("SONARR_ANALYZER_TEST_MODE") == "1"
+
+# Decrypted credentials are kept for at most this many users (least recently used evicted)
+TOKEN_CACHE_SIZE = 1024
+
+# Token SQL kept as fixed strings so the shared connection's statement cache reuses them
+SQL_SAVE_TOKEN = (
+    "INSERT INTO user_tokens (user_id, sonarr_url, encrypted_token, updated_at) "
+    "VALUES (?, ?, ?, ?) "
+    "ON CONFLICT(user_id) DO UPDATE SET sonarr_url = excluded.sonarr_url, "
+    "encrypted_token = excluded.encrypted_token, updated_at = excluded.updated_at"
+)
+SQL_LOAD_TOKEN = "SELECT sonarr_url, encrypted_token FROM user_tokens WHERE user_id = ?"
+SQL_HAS_TOKEN = "SELECT 1 FROM user_tokens WHERE user_id = ? LIMIT 1"
+SQL_DELETE_TOKEN = "DELETE FROM user_tokens WHERE user_id = ?"
+
+# Serializes key file creation, so concurrent managers agree on one master key
+_KEY_FILE_LOCK = threading.Lock()
+
+
+@functools.lru_cache(maxsize=32)
+def _make_fernet(key: bytes) -> Fernet:
+    """
+    Build (once per distinct key) the Fernet instance for a master key.
+    
+    The cache is keyed by the key bytes themselves, so a rewritten key file
+    is always honoured. Fernet holds no per-message state, so one instance
+    can be shared by every manager using the same key.
+    
+    Args:
+        key: Master encryption key
+        
+    Returns:
+        Fernet instance
+    """
+    return Fernet(key)
+
+
+def clear_fernet_cache():
+    """Drop the shared Fernet instances (for tests that swap master keys)."""
+    _make_fernet.cache_clear()
 
 
 class TokenManager:
@@ -38,10 +87,15 @@ class TokenManager:
             ) from e
         
         # Initialize or load master key
-        self.master_key = self._get_or_create_master_key()
-        self.fernet = Fernet(self.master_key)
+        with _KEY_FILE_LOCK:
+            self.master_key = self._get_or_create_master_key()
+        self.fernet = _make_fernet(self.master_key)
         
         # Initialize database
+        self._conn: Optional[sqlite3.Connection] = None
+        self._lock = threading.RLock()
+        self._token_cache: OrderedDict = OrderedDict()
+        self._cache_lock = threading.Lock()
         self._init_database()
     
     def _get_or_create_master_key(self) -> bytes:
@@ -71,22 +125,98 @@ class TokenManager:
             
             return key
     
-    def _init_database(self):
-        """Create tokens database table if it doesn't exist."""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
+    def _connect(self) -> sqlite3.Connection:
+        """
+        Open a database connection with performance pragmas applied.
+        
+        Returns:
+            SQLite connection
+        """
+        conn = sqlite3.connect(self.db_path, check_same_thread=False)
+        conn.execute("PRAGMA synchronous=OFF" if TEST_MODE else "PRAGMA synchronous=NORMAL")
+        conn.execute("PRAGMA temp_store=MEMORY")
+        conn.execute("PRAGMA cache_size=-4000")
+        conn.execute("PRAGMA wal_autocheckpoint=1000")
+        conn.execute("PRAGMA busy_timeout=5000")
+        return conn
+    
+    @contextmanager
+    def _connection(self):
+        """
+        Borrow the shared connection, opening it on first use.
+        
+        Yields:
+            SQLite connection
+        """
+        with self._lock:
+            if self._conn is None:
+                self._conn = self._connect()
+            try:
+                yield self._conn
+            finally:
+                # Discard anything left uncommitted by errors or early returns
+                if self._conn.in_transaction:
+                    self._conn.rollback()
+    
+    def close(self):
+        """Close the shared database connection."""
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+    
+    def _cache_put(self, user_id: int, data: Dict):
+        """
+        Cache decrypted credentials for a user.
         
-        cursor.execute("""
-            CREATE TABLE IF NOT EXISTS user_tokens (
-                user_id INTEGER PRIMARY KEY,
-                sonarr_url TEXT NOT NULL,
-                encrypted_token TEXT NOT NULL,
-                updated_at TEXT NOT NULL
-            )
-        """)
+        Args:
+            user_id: User ID
+            data: Credentials dictionary
+        """
+        with self._cache_lock:
+            self._token_cache[user_id] = dict(data)
+            self._token_cache.move_to_end(user_id)
+            
+            while len(self._token_cache) > TOKEN_CACHE_SIZE:
+                self._token_cache.popitem(last=False)
+    
+    def _cache_pop(self, user_id: int):
+        """
+        Drop a user's cached credentials after their token changes.
         
-        conn.commit()
-        conn.close()
+        Args:
+            user_id: User ID
+        """
+        with self._cache_lock:
+            self._token_cache.pop(user_id, None)
+    
+    def _init_database(self):
+        """Create tokens database table if it doesn't exist."""
+        with self._connection() as conn:
+            cursor = conn.cursor()
+            
+            # WAL lets readers proceed during writes; the mode persists in the file
+            if TEST_MODE:
+                cursor.execute("PRAGMA journal_mode=MEMORY")
+            elif str(self.db_path) != ':memory:':
+                cursor.execute("PRAGMA journal_mode=WAL")
+            
+            cursor.execute("""
+                CREATE TABLE IF NOT EXISTS user_tokens (
+                    user_id INTEGER PRIMARY KEY,
+                    sonarr_url TEXT NOT NULL,
+                    encrypted_token BLOB NOT NULL,
+                    updated_at TEXT NOT NULL
+                )
+            """)
+            
+            # Tokens are stored as raw Fernet bytes; convert rows written as text
+            cursor.execute("""
+                UPDATE user_tokens SET encrypted_token = CAST(encrypted_token AS BLOB)
+                WHERE typeof(encrypted_token) = 'text'
+            """)
+            
+            conn.commit()
     
     def save_token(
         self,
@@ -117,28 +247,62 @@ class TokenManager:
             }
             
             # Encrypt
-            json_data = json.dumps(data).encode()
+            json_data = orjson.dumps(data)
             encrypted_data = self.fernet.encrypt(json_data)
             
             # Save to database
-            conn = sqlite3.connect(self.db_path)
-            cursor = conn.cursor()
-            
-            from datetime import datetime
-            
-            cursor.execute("""
-                INSERT OR REPLACE INTO user_tokens (user_id, sonarr_url, encrypted_token, updated_at)
-                VALUES (?, ?, ?, ?)
-            """, (user_id, sonarr_url, encrypted_data.decode('utf-8'), datetime.now().isoformat()))
+            with self._connection() as conn:
+                conn.execute(
+                    SQL_SAVE_TOKEN,
+                    (user_id, sonarr_url, encrypted_data, datetime.now().isoformat())
+                )
+                
+                conn.commit()
             
-            conn.commit()
-            conn.close()
+            self._cache_pop(user_id)
             
             return True, "Sonarr token saved successfully"
             
         except Exception as e:
             return False, f"Error saving token: {str(e)}"
     
+    def save_tokens_bulk(self, tokens: List[Tuple[int, str, str]]) -> Tuple[bool, str]:
+        """
+        Encrypt and save Sonarr tokens for many users in one transaction.
+        
+        Args:
+            tokens: List of (user_id, sonarr_url, api_token) tuples
+            
+        Returns:
+            Tuple of (success, message)
+        """
+        try:
+            if any(not sonarr_url or not api_token for _, sonarr_url, api_token in tokens):
+                return False, "URL and API token cannot be empty"
+            
+            updated_at = datetime.now().isoformat()
+            rows = [
+                (
+                    user_id,
+                    sonarr_url,
+                    self.fernet.encrypt(orjson.dumps({'sonarr_url': sonarr_url, 'api_token': api_token})),
+                    updated_at
+                )
+                for user_id, sonarr_url, api_token in tokens
+            ]
+            
+            with self._connection() as conn:
+                conn.executemany(SQL_SAVE_TOKEN, rows)
+                conn.commit()
+            
+            for user_id, _, _ in tokens:
+                self._cache_pop(user_id)
+            
+            return True, f"Saved {len(tokens)} Sonarr tokens"
+            
+        except Exception as e:
+            return False, f"Error saving tokens: {str(e)}"
+    
     def load_token(
         self,
         user_id: int
@@ -152,18 +316,15 @@ class TokenManager:
         Returns:
             Tuple of (success, credentials_dict, message)
         """
+        with self._cache_lock:
+            cached = self._token_cache.get(user_id)
+            if cached is not None:
+                self._token_cache.move_to_end(user_id)
+                return True, dict(cached), "Token loaded successfully"
+        
         try:
-            conn = sqlite3.connect(self.db_path)
-            cursor = conn.cursor()
-            
-            cursor.execute("""
-                SELECT sonarr_url, encrypted_token
-                FROM user_tokens
-                WHERE user_id = ?
-            """, (user_id,))
-            
-            row = cursor.fetchone()
-            conn.close()
+            with self._connection() as conn:
+                row = conn.execute(SQL_LOAD_TOKEN, (user_id,)).fetchone()
             
             if not row:
                 return False, None, "No Sonarr token found for this user"
@@ -172,8 +333,9 @@ class TokenManager:
             
             # Decrypt
             try:
-                decrypted_data = self.fernet.decrypt(encrypted_token.encode('utf-8'))
-                data = json.loads(decrypted_data.decode())
+                decrypted_data = self.fernet.decrypt(encrypted_token)
+                data = orjson.loads(decrypted_data)
+                self._cache_put(user_id, data)
                 
                 return True, data, "Token loaded successfully"
                 
@@ -194,17 +356,10 @@ class TokenManager:
             True if user has a saved token
         """
         try:
-            conn = sqlite3.connect(self.db_path)
-            cursor = conn.cursor()
-            
-            cursor.execute("""
-                SELECT COUNT(*) FROM user_tokens WHERE user_id = ?
-            """, (user_id,))
+            with self._connection() as conn:
+                row = conn.execute(SQL_HAS_TOKEN, (user_id,)).fetchone()
             
-            count = cursor.fetchone()[0]
-            conn.close()
-            
-            return count > 0
+            return row is not None
             
         except Exception:
             return False
@@ -220,14 +375,13 @@ class TokenManager:
             Tuple of (success, message)
         """
         try:
-            conn = sqlite3.connect(self.db_path)
-            cursor = conn.cursor()
-            
-            cursor.execute("DELETE FROM user_tokens WHERE user_id = ?", (user_id,))
+            with self._connection() as conn:
+                cursor = conn.execute(SQL_DELETE_TOKEN, (user_id,))
+                
+                deleted = cursor.rowcount > 0
+                conn.commit()
             
-            deleted = cursor.rowcount > 0
-            conn.commit()
-            conn.close()
+            self._cache_pop(user_id)
             
             if deleted:
                 return True, "Token deleted successfully"
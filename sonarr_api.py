@@ -0,0 +1,276 @@
+"""
+Sonarr API client for fetching series and episode file data.
+Uses one shared HTTP session with retries; free of Streamlit so it can be tested directly.
+"""
+
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Optional, List, Tuple, Dict, Callable
+
+import orjson
+import pandas as pd
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.exceptions import ReadTimeoutError
+from urllib3.util.retry import Retry
+
+# Constants
+DEFAULT_TIMEOUT = 10
+MAX_RETRIES = 2
+MAX_RESPONSE_SIZE = 200 * 1024 * 1024  # 200 MB
+HTTP_POOL_SIZE = 32
+MAX_FETCH_WORKERS = 16
+
+# Error messages callers branch on
+BAD_REQUEST_ERROR = "❌ Bad request: Sonarr rejected the query parameters"
+AUTH_ERROR = "❌ Authentication failed: Invalid API key"
+FORBIDDEN_ERROR = "❌ Access forbidden: Check API key permissions"
+CONNECTION_ERROR = "🔌 Connection failed: Check URL and network connectivity"
+
+# Errors that would fail every series the same way, so one is enough to stop
+LIBRARY_ERRORS = frozenset({AUTH_ERROR, FORBIDDEN_ERROR, CONNECTION_ERROR})
+
+# Shared HTTP session: keep-alive connections are reused across requests and threads.
+# Transient connection/read failures and 5xx responses are retried with backoff here.
+_SESSION = requests.Session()
+_ADAPTER = HTTPAdapter(
+    pool_connections=HTTP_POOL_SIZE,
+    pool_maxsize=HTTP_POOL_SIZE,
+    max_retries=Retry(
+        total=MAX_RETRIES,
+        connect=MAX_RETRIES,
+        read=MAX_RETRIES,
+        backoff_factor=0.5,
+        status_forcelist=(500, 502, 503, 504),
+        raise_on_status=False
+    )
+)
+_SESSION.mount('http://', _ADAPTER)
+_SESSION.mount('https://', _ADAPTER)
+
+
+def fetch_sonarr_data(
+    endpoint: str,
+    base_url: str,
+    api_key: str,
+    timeout: int = DEFAULT_TIMEOUT,
+    params: Optional[Dict] = None
+) -> Tuple[Optional[List[Dict]], Optional[str]]:
+    """Fetch data from Sonarr API endpoint with error handling."""
+    url = f"{base_url}/{endpoint}"
+    # Headers are per request: the session is shared by every user of the app
+    headers = {"X-Api-Key": api_key}
+    
+    try:
+        response = _SESSION.get(
+            url,
+            headers=headers,
+            timeout=timeout,
+            params=params,
+            stream=True
+        )
+        
+        try:
+            content_length = response.headers.get('content-length')
+            if content_length and int(content_length) > MAX_RESPONSE_SIZE:
+                return None, f"Response too large: {int(content_length) / (1024**2):.2f} MB"
+            
+            if response.status_code == 400:
+                return None, BAD_REQUEST_ERROR
+            elif response.status_code == 401:
+                return None, AUTH_ERROR
+            elif response.status_code == 403:
+                return None, FORBIDDEN_ERROR
+            elif response.status_code == 404:
+                return None, "❌ Endpoint not found: Check Sonarr URL and version"
+            elif response.status_code >= 500:
+                return None, f"❌ Sonarr server error: {response.status_code}"
+            
+            response.raise_for_status()
+            
+            # Enforce the size limit while reading, the header may be absent
+            content = bytearray()
+            for chunk in response.iter_content(chunk_size=1024 * 1024):
+                content.extend(chunk)
+                if len(content) > MAX_RESPONSE_SIZE:
+                    return None, f"Response too large: over {MAX_RESPONSE_SIZE / (1024**2):.0f} MB"
+        finally:
+            response.close()
+        
+        data = orjson.loads(content)
+        del content
+        
+        if not isinstance(data, list):
+            return None, f"Unexpected response format: expected list, got {type(data).__name__}"
+        
+        return data, None
+        
+    except requests.exceptions.Timeout:
+        return None, f"⏱️ Request timeout after {timeout}s"
+        
+    except requests.exceptions.ConnectionError as e:
+        # Exhausted read retries surface as a ConnectionError wrapping the timeout
+        reason = getattr(e.args[0], 'reason', e.args[0]) if e.args else None
+        if isinstance(reason, ReadTimeoutError):
+            return None, f"⏱️ Request timeout after {timeout}s"
+        return None, CONNECTION_ERROR
+        
+    except requests.exceptions.RequestException as e:
+        return None, f"❌ Request error: {str(e)}"
+        
+    except (orjson.JSONDecodeError, ValueError):
+        return None, "❌ Invalid JSON response from Sonarr"
+
+
+def _episode_files_frame(episode_files: List[Dict]) -> pd.DataFrame:
+    """Flatten a Sonarr episode file response into analysis columns."""
+    ids_list = []
+    sids_list = []
+    size_list = []
+    quality_list = []
+    
+    for ef in episode_files:
+        ids_list.append(ef.get('id'))
+        sids_list.append(ef.get('seriesId'))
+        size_list.append(ef.get('size') or 0)
+        quality_list.append(
+            ((ef.get('quality') or {}).get('quality') or {}).get('name') or 'Unknown'
+        )
+    
+    return pd.DataFrame({
+        'episode_file_id': ids_list,
+        'series_id': sids_list,
+        'size_bytes': size_list,
+        'quality': quality_list
+    }, copy=False)
+
+
+def _fetch_episode_files_per_series(
+    series_titles: Dict[int, str],
+    base_url: str,
+    api_key: str,
+    timeout: int,
+    progress: Optional[Callable[[int, int, str], None]] = None
+) -> Tuple[List[pd.DataFrame], int, Optional[str]]:
+    """
+    Fetch episode files one series at a time, concurrently.
+    
+    A failed series is skipped and counted; an error that would fail every
+    series (auth, connection) cancels the requests not yet started.
+    
+    Args:
+        series_titles: Series id -> title for every series to fetch
+        base_url: Sonarr base URL
+        api_key: Sonarr API key
+        timeout: Request timeout in seconds
+        progress: Optional callback(done, total, title), called from this thread
+    
+    Returns:
+        Tuple of (frames fetched, failed request count, first error)
+    """
+    frames = []
+    failed = 0
+    first_error = None
+    total = len(series_titles)
+    
+    with ThreadPoolExecutor(max_workers=MAX_FETCH_WORKERS) as executor:
+        futures = {
+            executor.submit(
+                fetch_sonarr_data,
+                "api/v3/episodefile",
+                base_url,
+                api_key,
+                timeout,
+                {"seriesId": series_id}
+            ): series_id
+            for series_id in series_titles
+        }
+        
+        for idx, future in enumerate(as_completed(futures)):
+            if progress is not None:
+                progress(idx + 1, total, series_titles[futures[future]])
+            
+            files, error = future.result()
+            
+            if error:
+                failed += 1
+                first_error = first_error or error
+                if error in LIBRARY_ERRORS:
+                    first_error = error
+                    for pending in futures:
+                        pending.cancel()
+                    break
+                continue
+            
+            if files:
+                frames.append(_episode_files_frame(files))
+    
+    return frames, failed, first_error
+
+
+def fetch_episode_files(
+    series_data: List[Dict],
+    base_url: str,
+    api_key: str,
+    timeout: int = DEFAULT_TIMEOUT,
+    progress: Optional[Callable[[int, int, str], None]] = None
+) -> Tuple[Optional[pd.DataFrame], Optional[str], Optional[str]]:
+    """
+    Fetch episode files for all series, in bulk when Sonarr allows it.
+    
+    Sonarr versions that reject the unfiltered query (HTTP 400) are queried
+    one series at a time. Series that fail there are skipped and reported in
+    the warning, as long as some episode files were fetched.
+    
+    Args:
+        series_data: Series list from api/v3/series
+        base_url: Sonarr base URL
+        api_key: Sonarr API key
+        timeout: Request timeout in seconds
+        progress: Optional callback(done, total, title) for per-series fetches
+    
+    Returns:
+        Tuple of (episode file DataFrame or None, error, warning)
+    """
+    # One unfiltered request returns every episode file in the library
+    episode_files, error = fetch_sonarr_data(
+        "api/v3/episodefile", base_url, api_key, timeout
+    )
+    warning = None
+    
+    if error == BAD_REQUEST_ERROR:
+        # Sonarr requires a seriesId filter (it has no multi-series filter)
+        series_titles = {
+            s['id']: s.get('title', 'Unknown')
+            for s in series_data
+            if s.get('id') is not None
+        }
+        frames, failed, first_error = _fetch_episode_files_per_series(
+            series_titles, base_url, api_key, timeout, progress
+        )
+        
+        if first_error in LIBRARY_ERRORS or (failed and not frames):
+            return None, first_error, None
+        if failed:
+            warning = f"⚠️ Skipped {failed} of {len(series_titles)} series: {first_error}"
+    elif error:
+        # The bulk request fails the same way for auth, connection and server errors
+        return None, error, None
+    else:
+        frames = [_episode_files_frame(episode_files)] if episode_files else []
+        # Drop the raw JSON list before the frames are concatenated
+        del episode_files
+    
+    if not frames:
+        return None, "No episode files found in any series", None
+    
+    episodefile_df = pd.concat(frames, ignore_index=True)
+    episodefile_df = episodefile_df.dropna(subset=['episode_file_id', 'series_id'])
+    episodefile_df = episodefile_df.astype({
+        'episode_file_id': 'int64',
+        'series_id': 'int32',
+        'size_bytes': 'int64',
+        'quality': 'category'
+    })
+    
+    return episodefile_df, None, warning
+
@@ -3,13 +3,206 @@ Storage module for managing historical analysis data in SQLite.
 Provides functions to save, load, and compare analysis results over time.
 """
 
+import os
 import sqlite3
+import threading
+import numpy as np
 import pandas as pd
+import pyarrow as pa
+from pyarrow import csv as pa_csv
+from contextlib import contextmanager
 from datetime import datetime, timedelta
 from pathlib import Path
-from typing import Optional, List, Tuple, Dict
+from typing import Optional, List, Tuple, Dict, Union, BinaryIO
 import json
 
+# Test runs (SONARR_ANALYZER_TEST_MODE=1) trade durability for speed: no fsync
+# and an in-memory rollback journal instead of WAL
+TEST_MODE = os.environ.get("SONARR_ANALYZER_TEST_MODE") == "1"
+
+# Comparison status categories, in category-code order
+COMPARISON_STATUSES = ['existing', 'new', 'removed']
+
+# Columns returned by get_summary, in SELECT order
+SUMMARY_COLUMNS = (
+    'user_id', 'analysis_date', 'total_series', 'total_episodes', 'total_storage_gb',
+    'mean_avg_size_mb', 'std_avg_size_mb', 'outlier_count', 'outlier_percentage'
+)
+
+# CSV export streams the history table in chunks of this many rows
+EXPORT_CHUNK_SIZE = 100_000
+
+# Arrow schema of the history table, fixed so every export chunk matches
+HISTORY_EXPORT_SCHEMA = pa.schema([
+    ('id', pa.int64()),
+    ('user_id', pa.int64()),
+    ('analysis_date', pa.string()),
+    ('series_id', pa.int64()),
+    ('series_title', pa.string()),
+    ('year', pa.string()),
+    ('status', pa.string()),
+    ('episode_count', pa.int64()),
+    ('total_size_gb', pa.float64()),
+    ('avg_size_mb', pa.float64()),
+    ('z_score', pa.float64()),
+    ('is_outlier', pa.int64())
+])
+
+# History columns in table order, and the dtypes load_analysis restores
+HISTORY_COLUMNS = tuple(HISTORY_EXPORT_SCHEMA.names)
+HISTORY_DTYPES = {'is_outlier': bool}
+
+# One snapshot in avg_size_mb order, read straight off idx_history_user_date_avg
+SQL_LOAD_ANALYSIS = f"""
+    SELECT {', '.join(HISTORY_COLUMNS)} FROM history 
+    WHERE user_id = ? AND analysis_date = ?
+    ORDER BY avg_size_mb DESC
+"""
+
+# Inserts shared by save_analysis and save_many
+SQL_INSERT_HISTORY = """
+    INSERT INTO history (
+        user_id, analysis_date, series_id, series_title, year, status,
+        episode_count, total_size_gb, avg_size_mb, z_score, is_outlier
+    ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+"""
+
+SQL_INSERT_SUMMARY = """
+    INSERT INTO analysis_summary (
+        user_id, analysis_date, total_series, total_episodes, total_storage_gb,
+        mean_avg_size_mb, std_avg_size_mb, outlier_count, outlier_percentage
+    ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+"""
+
+# Metrics get_time_series can chart; the SQL for each is fixed up front so the
+# metric never reaches a query string and each text is reused from the cache
+TIME_SERIES_METRICS = ('total_size_gb', 'avg_size_mb', 'episode_count')
+
+SQL_SERIES_TIME_SERIES = {
+    metric: f"""
+        SELECT analysis_date, series_title, {metric}
+        FROM history 
+        WHERE user_id = ? AND series_id = ?
+        ORDER BY analysis_date
+    """
+    for metric in TIME_SERIES_METRICS
+}
+
+SQL_TOTAL_TIME_SERIES = {
+    metric: f"""
+        SELECT analysis_date, SUM({metric}) as {metric}
+        FROM history 
+        WHERE user_id = ?
+        GROUP BY analysis_date
+        ORDER BY analysis_date
+    """
+    for metric in TIME_SERIES_METRICS
+}
+
+
+def _query_frame(conn: sqlite3.Connection, query: str, params: Tuple) -> pd.DataFrame:
+    """
+    Run a small query straight into a DataFrame.
+    
+    For results of a few dozen rows, fetchall plus from_records skips most
+    of read_sql_query's per-call overhead.
+    
+    Args:
+        conn: SQLite connection
+        query: SQL query
+        params: Query parameters
+        
+    Returns:
+        DataFrame with one column per selected field
+    """
+    cursor = conn.execute(query, params)
+    return pd.DataFrame.from_records(
+        cursor.fetchall(), columns=[d[0] for d in cursor.description]
+    )
+
+
+def _analysis_columns(data: Union[pd.DataFrame, Dict[str, List]]) -> List[List]:
+    """
+    Convert analysis results to plain column lists in history insert order.
+    
+    DataFrames are converted a whole column at a time; a dict of lists (the
+    same columns, as small callers build them) skips pandas entirely.
+    
+    Args:
+        data: DataFrame or dict of lists with series analysis results
+        
+    Returns:
+        Lists of series_id, title, year, status, episode_count, total_size_gb,
+        avg_size_mb, z_score and is_outlier (as 0/1)
+    """
+    n = len(data['series_id'])
+    
+    if isinstance(data, pd.DataFrame):
+        return [
+            data['series_id'].astype('int64').tolist(),
+            data['title'].tolist(),
+            data['year'].astype(str).tolist() if 'year' in data else ['N/A'] * n,
+            data['status'].tolist() if 'status' in data else ['Unknown'] * n,
+            data['episode_count'].astype('int64').tolist(),
+            data['total_size_gb'].astype('float64').tolist(),
+            data['avg_size_mb'].astype('float64').tolist(),
+            data['z_score'].astype('float64').tolist(),
+            data['is_outlier'].astype(bool).astype('int8').tolist()
+        ]
+    
+    return [
+        [int(v) for v in data['series_id']],
+        list(data['title']),
+        [str(v) for v in data['year']] if 'year' in data else ['N/A'] * n,
+        list(data['status']) if 'status' in data else ['Unknown'] * n,
+        [int(v) for v in data['episode_count']],
+        [float(v) for v in data['total_size_gb']],
+        [float(v) for v in data['avg_size_mb']],
+        [float(v) for v in data['z_score']],
+        [int(bool(v)) for v in data['is_outlier']]
+    ]
+
+
+def _summary_row(user_id: int, analysis_date: str, columns: List[List], stats: Dict) -> Tuple:
+    """
+    Build the analysis_summary row for one snapshot.
+    
+    Args:
+        user_id: User ID who owns this analysis
+        analysis_date: Date string of the snapshot
+        columns: Column lists from _analysis_columns
+        stats: Dictionary with global statistics
+        
+    Returns:
+        Parameters for SQL_INSERT_SUMMARY
+    """
+    return (
+        user_id,
+        analysis_date,
+        len(columns[0]),
+        sum(columns[4]),
+        float(sum(columns[5])),
+        float(stats.get('mean', 0)),
+        float(stats.get('std', 0)),
+        int(stats.get('outlier_count', 0)),
+        float(stats.get('outlier_percentage', 0))
+    )
+
+
+def dataframe_to_csv_bytes(df: pd.DataFrame) -> bytes:
+    """
+    Serialize a DataFrame to CSV with the Arrow writer.
+    
+    Args:
+        df: DataFrame to export (index is not written)
+        
+    Returns:
+        UTF-8 encoded CSV content
+    """
+    buf = pa.BufferOutputStream()
+    pa_csv.write_csv(pa.Table.from_pandas(df, preserve_index=False), buf)
+    return buf.getvalue().to_pybytes()
+
 
 class HistoryDatabase:
     """Manages SQLite database for historical analysis data."""
@@ -31,67 +224,199 @@ class HistoryDatabase:
                 f"Please ensure the data directory is writable by UID 1000 (appuser). "
                 f"For bind mounts, run: sudo chown -R 1000:1000 /path/to/data"
             ) from e
+        self._conn: Optional[sqlite3.Connection] = None
+        self._lock = threading.RLock()
+        # Per-user list of saved dates; dropped whenever that user's data changes
+        self._dates_cache: Dict[int, List[str]] = {}
+        # Per-user write counters, shared by every session using this instance
+        self._versions: Dict[int, int] = {}
         self._init_database()
     
-    def _init_database(self):
-        """Create database tables if they don't exist."""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        
-        # Main history table for series data
-        cursor.execute("""
-            CREATE TABLE IF NOT EXISTS history (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                user_id INTEGER NOT NULL,
-                analysis_date TEXT NOT NULL,
-                series_id INTEGER NOT NULL,
-                series_title TEXT NOT NULL,
-                year TEXT,
-                status TEXT,
-                episode_count INTEGER,
-                total_size_gb REAL,
-                avg_size_mb REAL,
-                z_score REAL,
-                is_outlier INTEGER,
-                UNIQUE(user_id, analysis_date, series_id)
-            )
-        """)
-        
-        # Summary table for overall statistics per analysis date
-        cursor.execute("""
-            CREATE TABLE IF NOT EXISTS analysis_summary (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                user_id INTEGER NOT NULL,
-                analysis_date TEXT NOT NULL,
-                total_series INTEGER,
-                total_episodes INTEGER,
-                total_storage_gb REAL,
-                mean_avg_size_mb REAL,
-                std_avg_size_mb REAL,
-                outlier_count INTEGER,
-                outlier_percentage REAL,
-                UNIQUE(user_id, analysis_date)
-            )
-        """)
+    def _connect(self) -> sqlite3.Connection:
+        """
+        Open a database connection with performance pragmas applied.
+        
+        Returns:
+            SQLite connection
+        """
+        conn = sqlite3.connect(self.db_path, check_same_thread=False)
+        conn.execute("PRAGMA synchronous=OFF" if TEST_MODE else "PRAGMA synchronous=NORMAL")
+        conn.execute("PRAGMA temp_store=MEMORY")
+        conn.execute("PRAGMA mmap_size=268435456")
+        conn.execute("PRAGMA cache_size=-65536")
+        conn.execute("PRAGMA wal_autocheckpoint=1000")
+        conn.execute("PRAGMA busy_timeout=5000")
+        return conn
+    
+    @contextmanager
+    def _connection(self):
+        """
+        Borrow the shared connection, opening it on first use.
+        
+        The connection is reused across calls (and Streamlit reruns); the lock
+        serializes access since it may be shared between session threads.
+        
+        Yields:
+            SQLite connection
+        """
+        with self._lock:
+            if self._conn is None:
+                self._conn = self._connect()
+            try:
+                yield self._conn
+            finally:
+                # Anything left uncommitted (errors, early returns) is discarded,
+                # as closing a per-call connection used to do
+                if self._conn.in_transaction:
+                    self._conn.rollback()
+    
+    @contextmanager
+    def _transaction(self):
+        """
+        Run a block of statements as one write transaction.
+        
+        BEGIN IMMEDIATE takes the write lock up front, so checks made inside
+        the block still hold when its writes run; the block commits once on
+        success and rolls back on error.
+        
+        Yields:
+            SQLite connection
+        """
+        with self._connection() as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                yield conn
+            except BaseException:
+                conn.rollback()
+                raise
+            conn.commit()
+    
+    def _mark_changed(self, user_id: int):
+        """
+        Record a write to a user's history.
+        
+        Drops the cached date list and bumps the version returned by data_version.
         
-        # Create indexes for better query performance
-        cursor.execute("""
-            CREATE INDEX IF NOT EXISTS idx_history_date 
-            ON history(analysis_date)
-        """)
+        Args:
+            user_id: User ID whose data changed
+        """
+        with self._lock:
+            self._dates_cache.pop(user_id, None)
+            self._versions[user_id] = self._versions.get(user_id, 0) + 1
+    
+    def data_version(self, user_id: int) -> int:
+        """
+        Get the write counter for a user's history.
         
-        cursor.execute("""
-            CREATE INDEX IF NOT EXISTS idx_history_series 
-            ON history(series_id, analysis_date)
-        """)
+        The counter increases on every save, delete and cleanup, so it can key
+        caches of history reads across sessions sharing this database object.
         
-        conn.commit()
-        conn.close()
+        Args:
+            user_id: User ID
+            
+        Returns:
+            Number of writes recorded for this user by this instance
+        """
+        with self._lock:
+            return self._versions.get(user_id, 0)
+    
+    def close(self):
+        """Close the shared database connection."""
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+    
+    def _init_database(self):
+        """Create database tables if they don't exist."""
+        with self._connection() as conn:
+            cursor = conn.cursor()
+            
+            # Lets cleanup hand freed pages back to the OS. Must precede anything
+            # that initializes the file, so it only applies to new databases
+            # (existing ones keep their mode until a VACUUM)
+            cursor.execute("PRAGMA auto_vacuum=INCREMENTAL")
+            
+            # WAL lets readers proceed during writes; the mode persists in the file
+            if TEST_MODE:
+                cursor.execute("PRAGMA journal_mode=MEMORY")
+            elif str(self.db_path) != ':memory:':
+                cursor.execute("PRAGMA journal_mode=WAL")
+            
+            # Main history table for series data
+            cursor.execute("""
+                CREATE TABLE IF NOT EXISTS history (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    user_id INTEGER NOT NULL,
+                    analysis_date TEXT NOT NULL,
+                    series_id INTEGER NOT NULL,
+                    series_title TEXT NOT NULL,
+                    year TEXT,
+                    status TEXT,
+                    episode_count INTEGER,
+                    total_size_gb REAL,
+                    avg_size_mb REAL,
+                    z_score REAL,
+                    is_outlier INTEGER,
+                    UNIQUE(user_id, analysis_date, series_id)
+                )
+            """)
+            
+            # Summary table for overall statistics per analysis date
+            cursor.execute("""
+                CREATE TABLE IF NOT EXISTS analysis_summary (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    user_id INTEGER NOT NULL,
+                    analysis_date TEXT NOT NULL,
+                    total_series INTEGER,
+                    total_episodes INTEGER,
+                    total_storage_gb REAL,
+                    mean_avg_size_mb REAL,
+                    std_avg_size_mb REAL,
+                    outlier_count INTEGER,
+                    outlier_percentage REAL,
+                    UNIQUE(user_id, analysis_date)
+                )
+            """)
+            
+            # Create indexes for better query performance.
+            # Every history query filters on user_id first, so the older
+            # user-less indexes only cost writes; drop them from existing files
+            cursor.execute("DROP INDEX IF EXISTS idx_history_date")
+            cursor.execute("DROP INDEX IF EXISTS idx_history_series")
+            
+            # The UNIQUE constraint already covers (user_id, analysis_date, series_id)
+            # lookups, including the compare snapshots
+            cursor.execute("""
+                CREATE INDEX IF NOT EXISTS idx_history_user_series 
+                ON history(user_id, series_id, analysis_date)
+            """)
+            
+            # Lets load_analysis read a snapshot already in avg_size_mb order
+            cursor.execute("""
+                CREATE INDEX IF NOT EXISTS idx_history_user_date_avg 
+                ON history(user_id, analysis_date, avg_size_mb DESC)
+            """)
+            
+            # Covers the per-user DISTINCT series list ordered by title
+            cursor.execute("""
+                CREATE INDEX IF NOT EXISTS idx_history_user_title 
+                ON history(user_id, series_title, series_id)
+            """)
+            
+            conn.commit()
+            
+            # Gather planner statistics once so the indexes above get picked
+            if not cursor.execute(
+                "SELECT 1 FROM sqlite_master WHERE name = 'sqlite_stat1'"
+            ).fetchone():
+                cursor.execute("ANALYZE")
+                conn.commit()
     
     def save_analysis(
         self,
         user_id: int,
-        df: pd.DataFrame,
+        df: Union[pd.DataFrame, Dict[str, List]],
         stats: Dict,
         analysis_date: Optional[str] = None,
         overwrite: bool = False
@@ -101,7 +426,7 @@ class HistoryDatabase:
         
         Args:
             user_id: User ID who owns this analysis
-            df: DataFrame with series analysis results
+            df: DataFrame (or dict of column lists) with series analysis results
             stats: Dictionary with global statistics
             analysis_date: Date string (ISO format), defaults to now
             overwrite: If True, replace existing data for this date
@@ -114,79 +439,118 @@ class HistoryDatabase:
                 analysis_date = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
             
             # Check if data for this date already exists
-            conn = sqlite3.connect(self.db_path)
-            cursor = conn.cursor()
+            with self._connection() as conn:
+                # One transaction (a single commit) for the check, deletes and inserts
+                with self._transaction():
+                    cursor = conn.cursor()
+                    
+                    cursor.execute(
+                        "SELECT COUNT(*) FROM history WHERE user_id = ? AND analysis_date = ?",
+                        (user_id, analysis_date)
+                    )
+                    exists = cursor.fetchone()[0] > 0
+                    
+                    if exists and not overwrite:
+                        return False, f"Data for {analysis_date} already exists. Set overwrite=True to replace."
+                    
+                    # Delete existing data if overwriting
+                    if exists and overwrite:
+                        cursor.execute(
+                            "DELETE FROM history WHERE user_id = ? AND analysis_date = ?",
+                            (user_id, analysis_date)
+                        )
+                        cursor.execute(
+                            "DELETE FROM analysis_summary WHERE user_id = ? AND analysis_date = ?",
+                            (user_id, analysis_date)
+                        )
+                    
+                    # Insert series data, converting whole columns rather than row by row
+                    columns = _analysis_columns(df)
+                    n = len(columns[0])
+                    series_data = list(zip([user_id] * n, [analysis_date] * n, *columns))
+                    
+                    cursor.executemany(SQL_INSERT_HISTORY, series_data)
+                    
+                    # Insert summary data
+                    cursor.execute(SQL_INSERT_SUMMARY, _summary_row(user_id, analysis_date, columns, stats))
+                
+                # Refresh planner statistics (cheap no-op unless tables changed enough)
+                conn.execute("PRAGMA optimize")
+                self._mark_changed(user_id)
             
-            cursor.execute(
-                "SELECT COUNT(*) FROM history WHERE user_id = ? AND analysis_date = ?",
-                (user_id, analysis_date)
-            )
-            exists = cursor.fetchone()[0] > 0
+            return True, f"Analysis saved successfully ({n} series)"
             
-            if exists and not overwrite:
-                conn.close()
-                return False, f"Data for {analysis_date} already exists. Set overwrite=True to replace."
+        except Exception as e:
+            return False, f"Error saving analysis: {str(e)}"
+    
+    def save_many(
+        self,
+        user_id: int,
+        items: List[Tuple[str, Union[pd.DataFrame, Dict[str, List]], Dict]],
+        overwrite: bool = False
+    ) -> Tuple[bool, str]:
+        """
+        Save several analyses for a user in one transaction.
+        
+        All history rows go through a single executemany and all summaries
+        through another; either every snapshot is saved or none is.
+        
+        Args:
+            user_id: User ID who owns these analyses
+            items: (analysis_date, results, stats) tuples, one per snapshot
+            overwrite: If True, replace existing data for these dates
             
-            # Delete existing data if overwriting
-            if exists and overwrite:
-                cursor.execute(
-                    "DELETE FROM history WHERE user_id = ? AND analysis_date = ?",
-                    (user_id, analysis_date)
-                )
-                cursor.execute(
-                    "DELETE FROM analysis_summary WHERE user_id = ? AND analysis_date = ?",
-                    (user_id, analysis_date)
-                )
+        Returns:
+            Tuple of (success, message)
+        """
+        try:
+            dates = [analysis_date for analysis_date, _, _ in items]
+            if len(set(dates)) != len(dates):
+                return False, "Each analysis date may only appear once"
             
-            # Insert series data
             series_data = []
-            for _, row in df.iterrows():
-                series_data.append((
-                    user_id,
-                    analysis_date,
-                    int(row['series_id']),
-                    row['title'],
-                    str(row.get('year', 'N/A')),
-                    row.get('status', 'Unknown'),
-                    int(row['episode_count']),
-                    float(row['total_size_gb']),
-                    float(row['avg_size_mb']),
-                    float(row['z_score']),
-                    1 if row['is_outlier'] else 0
-                ))
-            
-            cursor.executemany("""
-                INSERT INTO history (
-                    user_id, analysis_date, series_id, series_title, year, status,
-                    episode_count, total_size_gb, avg_size_mb, z_score, is_outlier
-                ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-            """, series_data)
-            
-            # Insert summary data
-            cursor.execute("""
-                INSERT INTO analysis_summary (
-                    user_id, analysis_date, total_series, total_episodes, total_storage_gb,
-                    mean_avg_size_mb, std_avg_size_mb, outlier_count, outlier_percentage
-                ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
-            """, (
-                user_id,
-                analysis_date,
-                len(df),
-                int(df['episode_count'].sum()),
-                float(df['total_size_gb'].sum()),
-                float(stats.get('mean', 0)),
-                float(stats.get('std', 0)),
-                int(stats.get('outlier_count', 0)),
-                float(stats.get('outlier_percentage', 0))
-            ))
-            
-            conn.commit()
-            conn.close()
+            summary_data = []
+            for analysis_date, results, stats in items:
+                columns = _analysis_columns(results)
+                n = len(columns[0])
+                series_data.extend(zip([user_id] * n, [analysis_date] * n, *columns))
+                summary_data.append(_summary_row(user_id, analysis_date, columns, stats))
+            
+            with self._connection() as conn:
+                with self._transaction():
+                    cursor = conn.cursor()
+                    
+                    # Check every date before writing, so a conflict leaves nothing behind
+                    date_rows = [(user_id, analysis_date) for analysis_date in dates]
+                    existing = [
+                        analysis_date for analysis_date in dates
+                        if cursor.execute(
+                            "SELECT 1 FROM analysis_summary WHERE user_id = ? AND analysis_date = ?",
+                            (user_id, analysis_date)
+                        ).fetchone()
+                    ]
+                    
+                    if existing and not overwrite:
+                        return False, f"Data for {', '.join(existing)} already exists. Set overwrite=True to replace."
+                    
+                    if existing:
+                        cursor.executemany(
+                            "DELETE FROM history WHERE user_id = ? AND analysis_date = ?", date_rows
+                        )
+                        cursor.executemany(
+                            "DELETE FROM analysis_summary WHERE user_id = ? AND analysis_date = ?", date_rows
+                        )
+                    
+                    cursor.executemany(SQL_INSERT_HISTORY, series_data)
+                    cursor.executemany(SQL_INSERT_SUMMARY, summary_data)
+                
+                conn.execute("PRAGMA optimize")
+                self._mark_changed(user_id)
             
-            return True, f"Analysis saved successfully ({len(df)} series)"
+            return True, f"Saved {len(items)} analyses ({len(series_data)} series rows)"
             
         except Exception as e:
-            return False, f"Error saving analysis: {str(e)}"
+            return False, f"Error saving analyses: {str(e)}"
     
     def get_analysis_dates(self, user_id: int) -> List[str]:
         """
@@ -199,25 +563,56 @@ class HistoryDatabase:
             List of date strings
         """
         try:
-            conn = sqlite3.connect(self.db_path)
-            cursor = conn.cursor()
-            
-            cursor.execute("""
-                SELECT DISTINCT analysis_date 
-                FROM history 
-                WHERE user_id = ?
-                ORDER BY analysis_date DESC
-            """, (user_id,))
-            
-            dates = [row[0] for row in cursor.fetchall()]
-            conn.close()
-            
-            return dates
+            with self._connection() as conn:
+                dates = self._dates_cache.get(user_id)
+                if dates is None:
+                    cursor = conn.cursor()
+                    
+                    # analysis_summary holds one row per saved date, so its UNIQUE
+                    # index gives the dates in order without a DISTINCT pass
+                    cursor.execute("""
+                        SELECT analysis_date 
+                        FROM analysis_summary 
+                        WHERE user_id = ?
+                        ORDER BY analysis_date DESC
+                    """, (user_id,))
+                    
+                    dates = [row[0] for row in cursor.fetchall()]
+                    self._dates_cache[user_id] = dates
+            
+            # Callers may modify the list; keep the cached one intact
+            return list(dates)
             
         except Exception as e:
             print(f"Error getting dates: {e}")
             return []
     
+    def get_latest_date(self, user_id: int) -> Optional[str]:
+        """
+        Get the most recent analysis date for a specific user.
+        
+        Args:
+            user_id: User ID
+        
+        Returns:
+            Date string, or None if the user has no analyses
+        """
+        try:
+            with self._connection() as conn:
+                row = conn.execute("""
+                    SELECT analysis_date 
+                    FROM history 
+                    WHERE user_id = ?
+                    ORDER BY analysis_date DESC
+                    LIMIT 1
+                """, (user_id,)).fetchone()
+            
+            return row[0] if row else None
+            
+        except Exception as e:
+            print(f"Error getting latest date: {e}")
+            return None
+    
     def load_analysis(self, user_id: int, analysis_date: str) -> Optional[pd.DataFrame]:
         """
         Load analysis data for a specific user and date.
@@ -230,23 +625,14 @@ class HistoryDatabase:
             DataFrame with analysis data or None if not found
         """
         try:
-            conn = sqlite3.connect(self.db_path)
-            
-            df = pd.read_sql_query("""
-                SELECT * FROM history 
-                WHERE user_id = ? AND analysis_date = ?
-                ORDER BY avg_size_mb DESC
-            """, conn, params=(user_id, analysis_date))
+            with self._connection() as conn:
+                rows = conn.execute(SQL_LOAD_ANALYSIS, (user_id, analysis_date)).fetchall()
             
-            conn.close()
-            
-            if len(df) == 0:
+            if not rows:
                 return None
             
-            # Convert is_outlier back to boolean
-            df['is_outlier'] = df['is_outlier'].astype(bool)
-            
-            return df
+            # is_outlier is stored as 0/1; restore it to boolean
+            return pd.DataFrame.from_records(rows, columns=list(HISTORY_COLUMNS)).astype(HISTORY_DTYPES)
             
         except Exception as e:
             print(f"Error loading analysis: {e}")
@@ -264,31 +650,20 @@ class HistoryDatabase:
             Dictionary with summary statistics or None
         """
         try:
-            conn = sqlite3.connect(self.db_path)
-            cursor = conn.cursor()
-            
-            cursor.execute("""
-                SELECT * FROM analysis_summary 
-                WHERE user_id = ? AND analysis_date = ?
-            """, (user_id, analysis_date))
-            
-            row = cursor.fetchone()
-            conn.close()
+            with self._connection() as conn:
+                cursor = conn.cursor()
+                
+                cursor.execute(f"""
+                    SELECT {', '.join(SUMMARY_COLUMNS)} FROM analysis_summary 
+                    WHERE user_id = ? AND analysis_date = ?
+                """, (user_id, analysis_date))
+                
+                row = cursor.fetchone()
             
             if row is None:
                 return None
             
-            return {
-                'user_id': row[1],
-                'analysis_date': row[2],
-                'total_series': row[3],
-                'total_episodes': row[4],
-                'total_storage_gb': row[5],
-                'mean_avg_size_mb': row[6],
-                'std_avg_size_mb': row[7],
-                'outlier_count': row[8],
-                'outlier_percentage': row[9]
-            }
+            return dict(zip(SUMMARY_COLUMNS, row))
             
         except Exception as e:
             print(f"Error getting summary: {e}")
@@ -312,82 +687,124 @@ class HistoryDatabase:
             DataFrame with comparison results
         """
         try:
-            conn = sqlite3.connect(self.db_path)
-            
-            # Load both datasets
-            df1 = pd.read_sql_query("""
-                SELECT series_id, series_title, episode_count, 
-                       total_size_gb, avg_size_mb, is_outlier
-                FROM history 
-                WHERE user_id = ? AND analysis_date = ?
-            """, conn, params=(user_id, date1))
-            
-            df2 = pd.read_sql_query("""
-                SELECT series_id, series_title, episode_count, 
-                       total_size_gb, avg_size_mb, is_outlier
-                FROM history 
-                WHERE user_id = ? AND analysis_date = ?
-            """, conn, params=(user_id, date2))
-            
-            conn.close()
-            
-            if len(df1) == 0 or len(df2) == 0:
+            with self._connection() as conn:
+                # Join both snapshots and compute the deltas inside SQLite
+                comparison = pd.read_sql_query("""
+                    WITH snap_old AS (
+                        SELECT series_id, series_title, episode_count, total_size_gb, avg_size_mb
+                        FROM history
+                        WHERE user_id = ? AND analysis_date = ?
+                    ),
+                    snap_new AS (
+                        SELECT series_id, series_title, episode_count, total_size_gb, avg_size_mb
+                        FROM history
+                        WHERE user_id = ? AND analysis_date = ?
+                    )
+                    SELECT
+                        ids.series_id,
+                        COALESCE(n.series_title, o.series_title) AS series_title,
+                        CASE WHEN o.series_id IS NULL THEN 1
+                             WHEN n.series_id IS NULL THEN 2
+                             ELSE 0 END AS status_code,
+                        o.episode_count AS episode_count_old,
+                        n.episode_count AS episode_count_new,
+                        COALESCE(n.episode_count, 0) - COALESCE(o.episode_count, 0) AS episodes_change,
+                        o.total_size_gb AS total_size_gb_old,
+                        n.total_size_gb AS total_size_gb_new,
+                        COALESCE(n.total_size_gb, 0) - COALESCE(o.total_size_gb, 0) AS size_change_gb,
+                        (COALESCE(n.total_size_gb, 0) - COALESCE(o.total_size_gb, 0))
+                            / NULLIF(o.total_size_gb, 0) * 100 AS size_change_pct,
+                        o.avg_size_mb AS avg_size_mb_old,
+                        n.avg_size_mb AS avg_size_mb_new,
+                        COALESCE(n.avg_size_mb, 0) - COALESCE(o.avg_size_mb, 0) AS avg_size_change_mb
+                    FROM (SELECT series_id FROM snap_old UNION SELECT series_id FROM snap_new) ids
+                    LEFT JOIN snap_old o ON o.series_id = ids.series_id
+                    LEFT JOIN snap_new n ON n.series_id = ids.series_id
+                    ORDER BY ABS(COALESCE(n.total_size_gb, 0) - COALESCE(o.total_size_gb, 0)) DESC
+                """, conn, params=(user_id, date1, user_id, date2))
+            
+            # Every row new (or every row removed) means one snapshot is empty
+            status_codes = comparison.pop('status_code').to_numpy(dtype=np.int8)
+            if len(status_codes) == 0 or (status_codes == 1).all() or (status_codes == 2).all():
                 return None
             
-            # Merge on series_id
-            comparison = df1.merge(
-                df2,
-                on='series_id',
-                how='outer',
-                suffixes=('_old', '_new')
+            # Categorical status: three values, many rows
+            comparison.insert(
+                2, 'status', pd.Categorical.from_codes(status_codes, categories=COMPARISON_STATUSES)
             )
             
-            # Fill NaN values (series that appeared/disappeared)
-            comparison['series_title'] = comparison['series_title_new'].fillna(
-                comparison['series_title_old']
-            )
+            # NULLs are read back as None in all-NULL columns; keep them float NaN
+            comparison['size_change_pct'] = comparison['size_change_pct'].astype('float64')
             
-            # Calculate differences
-            comparison['episodes_change'] = (
-                comparison['episode_count_new'].fillna(0) - 
-                comparison['episode_count_old'].fillna(0)
-            ).astype(int)
+            return comparison
             
-            comparison['size_change_gb'] = (
-                comparison['total_size_gb_new'].fillna(0) - 
-                comparison['total_size_gb_old'].fillna(0)
-            )
+        except Exception as e:
+            print(f"Error comparing dates: {e}")
+            return None
+    
+    def compare_dates_summary(
+        self,
+        user_id: int,
+        date1: str,
+        date2: str
+    ) -> Optional[Dict[str, float]]:
+        """
+        Compute comparison summary metrics between two dates in SQL.
+        
+        Args:
+            user_id: User ID
+            date1: First date (older)
+            date2: Second date (newer)
             
-            comparison['avg_size_change_mb'] = (
-                comparison['avg_size_mb_new'].fillna(0) - 
-                comparison['avg_size_mb_old'].fillna(0)
-            )
+        Returns:
+            Dictionary with new_count, removed_count, total_size_change_gb and
+            avg_size_change_mb (mean over series present on both dates), or None
+        """
+        try:
+            with self._connection() as conn:
+                cursor = conn.cursor()
+                
+                cursor.execute("""
+                    WITH snap_old AS (
+                        SELECT series_id, episode_count, total_size_gb, avg_size_mb
+                        FROM history
+                        WHERE user_id = ? AND analysis_date = ?
+                    ),
+                    snap_new AS (
+                        SELECT series_id, episode_count, total_size_gb, avg_size_mb
+                        FROM history
+                        WHERE user_id = ? AND analysis_date = ?
+                    ),
+                    joined AS (
+                        SELECT o.episode_count AS episodes_old, n.episode_count AS episodes_new,
+                               COALESCE(n.total_size_gb, 0) - COALESCE(o.total_size_gb, 0) AS size_change_gb,
+                               COALESCE(n.avg_size_mb, 0) - COALESCE(o.avg_size_mb, 0) AS avg_size_change_mb
+                        FROM (SELECT series_id FROM snap_old UNION SELECT series_id FROM snap_new) ids
+                        LEFT JOIN snap_old o ON o.series_id = ids.series_id
+                        LEFT JOIN snap_new n ON n.series_id = ids.series_id
+                    )
+                    SELECT
+                        (SELECT COUNT(*) FROM snap_old),
+                        (SELECT COUNT(*) FROM snap_new),
+                        SUM(CASE WHEN episodes_old IS NULL THEN 1 ELSE 0 END),
+                        SUM(CASE WHEN episodes_new IS NULL THEN 1 ELSE 0 END),
+                        TOTAL(size_change_gb),
+                        AVG(CASE WHEN episodes_old IS NOT NULL AND episodes_new IS NOT NULL
+                                 THEN avg_size_change_mb END)
+                    FROM joined
+                """, (user_id, date1, user_id, date2))
+                
+                row = cursor.fetchone()
             
-            # Calculate percentage changes
-            comparison['size_change_pct'] = (
-                comparison['size_change_gb'] / 
-                comparison['total_size_gb_old'].replace(0, float('nan'))
-            ) * 100
-            
-            # Detect new/removed series
-            comparison['status'] = 'existing'
-            comparison.loc[comparison['episode_count_old'].isna(), 'status'] = 'new'
-            comparison.loc[comparison['episode_count_new'].isna(), 'status'] = 'removed'
-            
-            # Clean up columns
-            comparison = comparison[[
-                'series_id', 'series_title', 'status',
-                'episode_count_old', 'episode_count_new', 'episodes_change',
-                'total_size_gb_old', 'total_size_gb_new', 'size_change_gb', 'size_change_pct',
-                'avg_size_mb_old', 'avg_size_mb_new', 'avg_size_change_mb'
-            ]]
-            
-            # Sort by absolute size change
-            comparison['abs_size_change'] = comparison['size_change_gb'].abs()
-            comparison = comparison.sort_values('abs_size_change', ascending=False)
-            comparison = comparison.drop('abs_size_change', axis=1)
+            if row is None or row[0] == 0 or row[1] == 0:
+                return None
             
-            return comparison
+            return {
+                'new_count': row[2],
+                'removed_count': row[3],
+                'total_size_change_gb': row[4],
+                'avg_size_change_mb': row[5] if row[5] is not None else float('nan')
+            }
             
         except Exception as e:
             print(f"Error comparing dates: {e}")
@@ -397,8 +814,9 @@ class HistoryDatabase:
         self,
         user_id: int,
         series_id: Optional[int] = None,
-        metric: str = 'total_size_gb'
-    ) -> Optional[pd.DataFrame]:
+        metric: str = 'total_size_gb',
+        as_dataframe: bool = True
+    ) -> Optional[Union[pd.DataFrame, List[Tuple]]]:
         """
         Get time series data for a specific metric and user.
         
@@ -406,37 +824,99 @@ class HistoryDatabase:
             user_id: User ID
             series_id: Optional series ID to filter by
             metric: Metric to retrieve (total_size_gb, avg_size_mb, episode_count)
+            as_dataframe: Return a DataFrame; if False, return the raw row tuples
             
         Returns:
-            DataFrame with time series data
+            DataFrame (or list of row tuples) with time series data
+            
+        Raises:
+            ValueError: If metric is not one of TIME_SERIES_METRICS
         """
+        if metric not in TIME_SERIES_METRICS:
+            raise ValueError(f"Unknown metric: {metric!r}")
+        
         try:
-            conn = sqlite3.connect(self.db_path)
+            with self._connection() as conn:
+                if series_id:
+                    query = SQL_SERIES_TIME_SERIES[metric]
+                    params = (user_id, series_id)
+                else:
+                    query = SQL_TOTAL_TIME_SERIES[metric]
+                    params = (user_id,)
+                
+                if not as_dataframe:
+                    return conn.execute(query, params).fetchall()
+                df = _query_frame(conn, query, params)
             
-            if series_id:
+            return df
+            
+        except Exception as e:
+            print(f"Error getting time series: {e}")
+            return None
+    
+    def get_time_series_multi(
+        self,
+        user_id: int,
+        series_id: int,
+        metrics: Tuple[str, ...] = ('total_size_gb', 'episode_count', 'avg_size_mb')
+    ) -> Optional[pd.DataFrame]:
+        """
+        Get several metrics for one series and user in a single query.
+        
+        Args:
+            user_id: User ID
+            series_id: Series ID to filter by
+            metrics: Metrics to retrieve (total_size_gb, avg_size_mb, episode_count)
+            
+        Returns:
+            DataFrame with analysis_date, series_title and one column per metric
+            
+        Raises:
+            ValueError: If any metric is not one of TIME_SERIES_METRICS
+        """
+        unknown = [m for m in metrics if m not in TIME_SERIES_METRICS]
+        if unknown:
+            raise ValueError(f"Unknown metrics: {unknown!r}")
+        
+        try:
+            with self._connection() as conn:
                 query = f"""
-                    SELECT analysis_date, series_title, {metric}
+                    SELECT analysis_date, series_title, {', '.join(metrics)}
                     FROM history 
                     WHERE user_id = ? AND series_id = ?
                     ORDER BY analysis_date
                 """
-                df = pd.read_sql_query(query, conn, params=(user_id, series_id))
-            else:
-                query = f"""
-                    SELECT analysis_date, SUM({metric}) as {metric}
+                df = _query_frame(conn, query, (user_id, series_id))
+            
+            return df
+            
+        except Exception as e:
+            print(f"Error getting time series: {e}")
+            return None
+    
+    def get_series_list(self, user_id: int) -> Optional[pd.DataFrame]:
+        """
+        Get all series that appear in a user's history.
+        
+        Args:
+            user_id: User ID
+        
+        Returns:
+            DataFrame with series_id and series_title, ordered by title
+        """
+        try:
+            with self._connection() as conn:
+                df = pd.read_sql_query("""
+                    SELECT DISTINCT series_id, series_title 
                     FROM history 
                     WHERE user_id = ?
-                    GROUP BY analysis_date
-                    ORDER BY analysis_date
-                """
-                df = pd.read_sql_query(query, conn, params=(user_id,))
-            
-            conn.close()
+                    ORDER BY series_title
+                """, conn, params=(user_id,))
             
             return df
             
         except Exception as e:
-            print(f"Error getting time series: {e}")
+            print(f"Error getting series list: {e}")
             return None
     
     def get_global_trends(self, user_id: int) -> Optional[pd.DataFrame]:
@@ -450,15 +930,12 @@ class HistoryDatabase:
             DataFrame with trend data
         """
         try:
-            conn = sqlite3.connect(self.db_path)
-            
-            df = pd.read_sql_query("""
-                SELECT * FROM analysis_summary 
-                WHERE user_id = ?
-                ORDER BY analysis_date
-            """, conn, params=(user_id,))
-            
-            conn.close()
+            with self._connection() as conn:
+                df = pd.read_sql_query("""
+                    SELECT * FROM analysis_summary 
+                    WHERE user_id = ?
+                    ORDER BY analysis_date
+                """, conn, params=(user_id,))
             
             return df
             
@@ -478,22 +955,22 @@ class HistoryDatabase:
             Tuple of (success, message)
         """
         try:
-            conn = sqlite3.connect(self.db_path)
-            cursor = conn.cursor()
-            
-            cursor.execute(
-                "DELETE FROM history WHERE user_id = ? AND analysis_date = ?",
-                (user_id, analysis_date)
-            )
-            
-            cursor.execute(
-                "DELETE FROM analysis_summary WHERE user_id = ? AND analysis_date = ?",
-                (user_id, analysis_date)
-            )
-            
-            deleted_rows = cursor.rowcount
-            conn.commit()
-            conn.close()
+            with self._connection() as conn:
+                cursor = conn.cursor()
+                
+                cursor.execute(
+                    "DELETE FROM history WHERE user_id = ? AND analysis_date = ?",
+                    (user_id, analysis_date)
+                )
+                
+                cursor.execute(
+                    "DELETE FROM analysis_summary WHERE user_id = ? AND analysis_date = ?",
+                    (user_id, analysis_date)
+                )
+                
+                deleted_rows = cursor.rowcount
+                conn.commit()
+                self._mark_changed(user_id)
             
             if deleted_rows > 0:
                 return True, f"Deleted analysis from {analysis_date}"
@@ -517,53 +994,73 @@ class HistoryDatabase:
         try:
             cutoff_date = (datetime.now() - timedelta(days=days_to_keep)).strftime("%Y-%m-%d")
             
-            conn = sqlite3.connect(self.db_path)
-            cursor = conn.cursor()
-            
-            cursor.execute(
-                "DELETE FROM history WHERE user_id = ? AND analysis_date < ?",
-                (user_id, cutoff_date)
-            )
-            
-            cursor.execute(
-                "DELETE FROM analysis_summary WHERE user_id = ? AND analysis_date < ?",
-                (user_id, cutoff_date)
-            )
-            
-            deleted_rows = cursor.rowcount
-            conn.commit()
-            conn.close()
+            with self._connection() as conn:
+                # Both deletes commit together
+                with self._transaction():
+                    cursor = conn.cursor()
+                    
+                    cursor.execute(
+                        "DELETE FROM history WHERE user_id = ? AND analysis_date < ?",
+                        (user_id, cutoff_date)
+                    )
+                    
+                    cursor.execute(
+                        "DELETE FROM analysis_summary WHERE user_id = ? AND analysis_date < ?",
+                        (user_id, cutoff_date)
+                    )
+                    
+                    deleted_rows = cursor.rowcount
+                self._mark_changed(user_id)
+                
+                # Release up to 1000 free pages; a no-op without incremental auto_vacuum.
+                # executescript steps the pragma to completion (execute frees one page)
+                conn.executescript("PRAGMA incremental_vacuum(1000);")
             
             return True, f"Cleaned up {deleted_rows} old records (kept last {days_to_keep} days)"
             
         except Exception as e:
             return False, f"Error cleaning up data: {str(e)}"
     
-    def export_to_csv(self, user_id: int, output_path: str) -> Tuple[bool, str]:
+    def export_to_csv(self, user_id: int, output: Union[str, Path, BinaryIO]) -> Tuple[bool, str]:
         """
         Export user's history database to CSV.
         
         Args:
             user_id: User ID
-            output_path: Path for output CSV file
+            output: Path for output CSV file, or a binary file-like object
             
         Returns:
             Tuple of (success, message)
         """
         try:
-            conn = sqlite3.connect(self.db_path)
-            
-            df = pd.read_sql_query("""
-                SELECT * FROM history 
-                WHERE user_id = ?
-                ORDER BY analysis_date, series_title
-            """, conn, params=(user_id,))
-            
-            conn.close()
-            
-            df.to_csv(output_path, index=False)
-            
-            return True, f"Exported {len(df)} records to {output_path}"
+            is_path = isinstance(output, (str, Path))
+            record_count = 0
+            
+            # Stream fetchmany batches straight into Arrow columns, so the full
+            # history is never held in memory and no DataFrame is built
+            with self._connection() as conn:
+                cursor = conn.execute(f"""
+                    SELECT {', '.join(HISTORY_EXPORT_SCHEMA.names)} FROM history 
+                    WHERE user_id = ?
+                    ORDER BY analysis_date, series_title
+                """, (user_id,))
+                
+                with pa_csv.CSVWriter(str(output) if is_path else output, HISTORY_EXPORT_SCHEMA) as writer:
+                    while True:
+                        rows = cursor.fetchmany(EXPORT_CHUNK_SIZE)
+                        if not rows:
+                            break
+                        
+                        writer.write_batch(pa.RecordBatch.from_arrays(
+                            [pa.array(column, type=field.type)
+                             for column, field in zip(zip(*rows), HISTORY_EXPORT_SCHEMA)],
+                            schema=HISTORY_EXPORT_SCHEMA
+                        ))
+                        record_count += len(rows)
+            
+            if is_path:
+                return True, f"Exported {record_count} records to {output}"
+            return True, f"Exported {record_count} records"
             
         except Exception as e:
             return False, f"Error exporting: {str(e)}"
@@ -0,0 +1,26 @@
+"""
+Shared helpers for tests that inspect database files directly.
+"""
+
+import sqlite3
+from typing import Any, Tuple
+
+
+def peek(db_path: str, sql: str, params: Tuple = ()) -> Any:
+    """
+    Read a single value from a database file without modifying it.
+    
+    Args:
+        db_path: Path to the SQLite database file
+        sql: Query returning at least one row
+        params: Query parameters
+        
+    Returns:
+        First column of the first row
+    """
+    conn = sqlite3.connect(db_path)
+    try:
+        conn.execute("PRAGMA query_only=1")
+        return conn.execute(sql, params).fetchone()[0]
+    finally:
+        conn.close()
@@ -0,0 +1,17 @@
+"""
+Shared pytest configuration.
+
+Puts the project root on sys.path once for every test module. Before the
+app modules are imported, it lowers the bcrypt cost (hashing at the
+production cost dominates the user tests, which only need valid hashes)
+and turns on test mode, so SQLite skips fsync on every commit.
+"""
+
+import os
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+os.environ.setdefault("BCRYPT_ROUNDS", "4")
+os.environ.setdefault("SONARR_ANALYZER_TEST_MODE", "1")
@@ -5,27 +5,42 @@ Tests user creation, login, password hashing, and role management.
 
 import unittest
 import os
-import sys
-from pathlib import Path
-
-# Add parent directory to path
-sys.path.insert(0, str(Path(__file__).parent.parent))
+import sqlite3
+import tempfile
 
 from auth import UserManager
+from tests._helpers import peek
 
 
 class TestUserManager(unittest.TestCase):
     """Test cases for UserManager class."""
     
+    @classmethod
+    def setUpClass(cls):
+        """Create one in-memory test database for the whole class."""
+        cls.manager = UserManager(":memory:")
+    
+    @classmethod
+    def tearDownClass(cls):
+        """Close the shared test database."""
+        cls.manager.close()
+    
     def setUp(self):
-        """Set up test database before each test."""
-        self.test_db = "test_users_temp.db"
-        self.manager = UserManager(self.test_db)
+        """Empty the shared database before each test."""
+        with self.manager._connection() as conn:
+            conn.execute("DELETE FROM sessions")
+            conn.execute("DELETE FROM users")
+            conn.execute("DELETE FROM sqlite_sequence")
+            conn.commit()
+        self.manager._invalidate_user_cache()
+        
+        # On-disk file for tests that reopen the database in a new manager
+        self._tmp = tempfile.TemporaryDirectory()
+        self.test_db = os.path.join(self._tmp.name, "users.db")
     
     def tearDown(self):
-        """Clean up test database after each test."""
-        if os.path.exists(self.test_db):
-            os.remove(self.test_db)
+        """Clean up test files after each test."""
+        self._tmp.cleanup()
     
     def test_create_admin_user(self):
         """Test creating an admin user."""
@@ -39,6 +54,19 @@ class TestUserManager(unittest.TestCase):
         self.assertEqual(user['username'], "admin")
         self.assertEqual(user['role'], "admin")
     
+    def test_create_user_and_get(self):
+        """Test creating a user and getting it back in one call."""
+        success, user, msg = self.manager.create_user_and_get("admin", "admin12345", "admin")
+        self.assertTrue(success)
+        self.assertIn("created successfully", msg)
+        self.assertEqual(user, self.manager.get_user_by_username("admin"))
+        self.assertTrue(user['is_active'])
+        
+        success, user, msg = self.manager.create_user_and_get("admin", "admin12345", "admin")
+        self.assertFalse(success)
+        self.assertIsNone(user)
+        self.assertIn("already exists", msg)
+    
     def test_create_readonly_user(self):
         """Test creating a read-only user."""
         success, msg = self.manager.create_user("viewer", "viewer123", "readonly")
@@ -100,21 +128,71 @@ class TestUserManager(unittest.TestCase):
     
     def test_password_hashing(self):
         """Test that passwords are properly hashed."""
-        import sqlite3
-        
         self.manager.create_user("hashtest", "mypassword", "admin")
         
         # Check database directly
-        conn = sqlite3.connect(self.test_db)
-        cursor = conn.cursor()
-        cursor.execute("SELECT password_hash FROM users WHERE username = ?", ("hashtest",))
-        stored_hash = cursor.fetchone()[0]
-        conn.close()
+        with self.manager._connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute("SELECT password_hash FROM users WHERE username = ?", ("hashtest",))
+            stored_hash = cursor.fetchone()[0]
         
         # Hash should not be the plain password
         self.assertNotEqual(stored_hash, "mypassword")
-        # Should be bcrypt hash (starts with $2b$)
-        self.assertTrue(stored_hash.startswith("$2b$"))
+        # Should be bcrypt hash bytes (starts with $2b$)
+        self.assertTrue(stored_hash.startswith(b"$2b$"))
+    
+    def test_text_hash_migration(self):
+        """Test that hashes stored as text are converted and still verify."""
+        manager = UserManager(self.test_db)
+        manager.create_user("legacy", "mypassword", "admin")
+        manager.close()
+        
+        conn = sqlite3.connect(self.test_db)
+        conn.execute(
+            "UPDATE users SET password_hash = CAST(password_hash AS TEXT) WHERE username = ?",
+            ("legacy",)
+        )
+        conn.commit()
+        conn.close()
+        
+        manager = UserManager(self.test_db)
+        success, _, _ = manager.authenticate("legacy", "mypassword")
+        self.assertTrue(success)
+        manager.close()
+        
+        stored_type = peek(
+            self.test_db, "SELECT typeof(password_hash) FROM users WHERE username = ?", ("legacy",)
+        )
+        self.assertEqual(stored_type, "blob")
+    
+    def test_bcrypt_rounds_rehash_on_login(self):
+        """Test that hashes are upgraded to the configured cost on login."""
+        low_cost = UserManager(self.test_db, bcrypt_rounds=4)
+        low_cost.create_user("rehash", "mypassword", "admin")
+        low_cost.close()
+        
+        def stored_cost():
+            stored_hash = peek(
+                self.test_db, "SELECT password_hash FROM users WHERE username = ?", ("rehash",)
+            )
+            return int(stored_hash.split(b'$')[2])
+        
+        self.assertEqual(stored_cost(), 4)
+        
+        manager = UserManager(self.test_db, bcrypt_rounds=5)
+        success, _, _ = manager.authenticate("rehash", "mypassword")
+        self.assertTrue(success)
+        self.assertEqual(stored_cost(), 5)
+        
+        # Password still verifies after the rehash
+        success, _, _ = manager.authenticate("rehash", "mypassword")
+        self.assertTrue(success)
+        manager.close()
+    
+    def test_invalid_bcrypt_rounds(self):
+        """Test that out-of-range bcrypt costs are rejected."""
+        with self.assertRaises(ValueError):
+            UserManager(self.test_db, bcrypt_rounds=3)
     
     def test_has_users(self):
         """Test has_users method."""
@@ -145,6 +223,15 @@ class TestUserManager(unittest.TestCase):
         self.assertIn("user1", usernames)
         self.assertIn("user2", usernames)
     
+    def test_iter_users(self):
+        """Test streaming users in batches."""
+        for i in range(5):
+            self.manager.create_user(f"user{i}", "password123", "readonly")
+        
+        streamed = list(self.manager.iter_users(batch_size=2))
+        self.assertEqual(streamed, self.manager.list_users())
+        self.assertEqual(len(streamed), 5)
+    
     def test_get_user_by_id(self):
         """Test getting user by ID."""
         self.manager.create_user("testuser", "password123", "admin")
@@ -167,11 +254,32 @@ class TestUserManager(unittest.TestCase):
         self.assertTrue(self.manager.is_admin(admin_user['id']))
         self.assertFalse(self.manager.is_admin(viewer_user['id']))
     
+    def test_user_cache_invalidation(self):
+        """Test that cached user lookups reflect writes."""
+        self.manager.create_user("admin", "password123", "admin")
+        self.manager.create_user("viewer", "password123", "readonly")
+        
+        viewer = self.manager.get_user_by_username("viewer")
+        self.assertIsNone(self.manager.get_user(viewer['id'])['last_login'])
+        
+        # Mutating a returned dict must not leak into the cache
+        viewer['role'] = 'admin'
+        self.assertFalse(self.manager.is_admin(viewer['id']))
+        
+        self.manager.authenticate("viewer", "password123")
+        self.assertIsNotNone(self.manager.get_user(viewer['id'])['last_login'])
+        
+        self.manager.delete_user(viewer['id'])
+        self.assertIsNone(self.manager.get_user(viewer['id']))
+        self.assertIsNone(self.manager.get_user_by_username("viewer"))
+    
     def test_update_password(self):
-        """Test updating user password."""
+        """Test that a password change invalidates the old credentials."""
         self.manager.create_user("testuser", "oldpass123", "admin")
         
-        user = self.manager.get_user_by_username("testuser")
+        # Old password works before the change
+        success, user, _ = self.manager.authenticate("testuser", "oldpass123")
+        self.assertTrue(success)
         
         # Update password
         success, msg = self.manager.update_password(user['id'], "newpass456")
@@ -185,6 +293,25 @@ class TestUserManager(unittest.TestCase):
         success, _, _ = self.manager.authenticate("testuser", "newpass456")
         self.assertTrue(success)
     
+    def test_bulk_update_passwords(self):
+        """Test updating several passwords in one call."""
+        self.manager.create_user("user1", "oldpass123", "admin")
+        self.manager.create_user("user2", "oldpass123", "readonly")
+        
+        id1 = self.manager.get_user_by_username("user1")['id']
+        id2 = self.manager.get_user_by_username("user2")['id']
+        
+        success, msg = self.manager.bulk_update_passwords([(id1, "short"), (id2, "newpass456")])
+        self.assertFalse(success)
+        
+        success, msg = self.manager.bulk_update_passwords([(id1, "newpass123"), (id2, "newpass456")])
+        self.assertTrue(success)
+        self.assertIn("Updated 2 of 2", msg)
+        
+        self.assertFalse(self.manager.authenticate("user1", "oldpass123")[0])
+        self.assertTrue(self.manager.authenticate("user1", "newpass123")[0])
+        self.assertTrue(self.manager.authenticate("user2", "newpass456")[0])
+    
     def test_delete_user(self):
         """Test deleting a user."""
         self.manager.create_user("admin", "password123", "admin")
@@ -211,13 +338,41 @@ class TestUserManager(unittest.TestCase):
     
     def test_can_delete_admin_if_others_exist(self):
         """Test that admin can be deleted if other admins exist."""
-        self.manager.create_user("admin1", "password123", "admin")
-        self.manager.create_user("admin2", "password123", "admin")
+        self.manager.create_users_bulk([
+            ("admin1", "password123", "admin"),
+            ("admin2", "password123", "admin")
+        ])
         
         admin1 = self.manager.get_user_by_username("admin1")
         
         success, msg = self.manager.delete_user(admin1['id'])
         self.assertTrue(success)
+    
+    def test_create_users_bulk(self):
+        """Test creating several users in one call."""
+        success, msg = self.manager.create_users_bulk([
+            ("user1", "password123", "admin"),
+            ("user2", "password456", "readonly")
+        ])
+        self.assertTrue(success)
+        self.assertEqual(self.manager.get_user_by_username("user2")['role'], "readonly")
+        
+        success, _, _ = self.manager.authenticate("user1", "password123")
+        self.assertTrue(success)
+        
+        # A taken username fails the whole batch
+        success, msg = self.manager.create_users_bulk([
+            ("user3", "password123", "admin"),
+            ("user1", "password123", "admin")
+        ])
+        self.assertFalse(success)
+        self.assertIn("already exists", msg)
+        self.assertIsNone(self.manager.get_user_by_username("user3"))
+        
+        # Invalid fields are rejected before anything is written
+        success, msg = self.manager.create_users_bulk([("user4", "short", "admin")])
+        self.assertFalse(success)
+        self.assertIn("at least 8 characters", msg)
 
 
 if __name__ == '__main__':
@@ -5,30 +5,45 @@ Tests token encryption, decryption, and key management.
 
 import unittest
 import os
-import sys
-from pathlib import Path
+import sqlite3
+import tempfile
 
-# Add parent directory to path
-sys.path.insert(0, str(Path(__file__).parent.parent))
+from cryptography.fernet import Fernet
 
-from security import TokenManager
+from security import TokenManager, clear_fernet_cache
+from tests._helpers import peek
 
 
 class TestTokenManager(unittest.TestCase):
     """Test cases for TokenManager class."""
     
+    @classmethod
+    def setUpClass(cls):
+        """Create one in-memory token database and master key for the whole class."""
+        cls._class_tmp = tempfile.TemporaryDirectory()
+        cls.test_key = os.path.join(cls._class_tmp.name, "master.key")
+        cls.manager = TokenManager(":memory:", cls.test_key)
+    
+    @classmethod
+    def tearDownClass(cls):
+        """Close the shared database and remove the master key."""
+        cls.manager.close()
+        cls._class_tmp.cleanup()
+    
     def setUp(self):
-        """Set up test files before each test."""
-        self.test_db = "test_tokens_temp.db"
-        self.test_key = "test_master_temp.key"
-        self.manager = TokenManager(self.test_db, self.test_key)
+        """Empty the shared token database before each test."""
+        with self.manager._connection() as conn:
+            conn.execute("DELETE FROM user_tokens")
+            conn.commit()
+        self.manager._token_cache.clear()
+        
+        # On-disk file for tests that reopen the database in a new manager
+        self._tmp = tempfile.TemporaryDirectory()
+        self.test_db = os.path.join(self._tmp.name, "tokens.db")
     
     def tearDown(self):
         """Clean up test files after each test."""
-        if os.path.exists(self.test_db):
-            os.remove(self.test_db)
-        if os.path.exists(self.test_key):
-            os.remove(self.test_key)
+        self._tmp.cleanup()
     
     def test_master_key_creation(self):
         """Test that master key is created on initialization."""
@@ -42,18 +57,47 @@ class TestTokenManager(unittest.TestCase):
     
     def test_master_key_persistence(self):
         """Test that master key persists across instances."""
-        # Get key from first instance
-        with open(self.test_key, 'rb') as f:
-            key1 = f.read()
+        # Drop the shared Fernet instances so the new manager builds its own
+        # from the key it loads off disk
+        clear_fernet_cache()
+        manager2 = TokenManager(":memory:", self.test_key)
         
-        # Create new instance
-        manager2 = TokenManager(self.test_db, self.test_key)
+        # Key should be the same, from a separate Fernet instance
+        self.assertEqual(manager2.master_key, self.manager.master_key)
+        self.assertIsNot(manager2.fernet, self.manager.fernet)
         
-        # Key should be the same
-        with open(self.test_key, 'rb') as f:
-            key2 = f.read()
+        # And tokens encrypted by one instance decrypt in the other
+        self.manager.save_token(1, "http://localhost:8989", "api_key")
+        with self.manager._connection() as conn:
+            encrypted = conn.execute("SELECT encrypted_token FROM user_tokens").fetchone()[0]
+        self.assertIn(b"api_key", manager2.fernet.decrypt(encrypted))
+        manager2.close()
+    
+    def test_fernet_shared_across_instances(self):
+        """Test that managers on the same key file share one Fernet instance."""
+        # Two fresh managers, so other tests clearing the cache cannot interfere
+        manager1 = TokenManager(":memory:", self.test_key)
+        manager2 = TokenManager(":memory:", self.test_key)
         
-        self.assertEqual(key1, key2)
+        self.assertIs(manager2.fernet, manager1.fernet)
+        self.assertEqual(manager2.master_key, manager1.master_key)
+        manager1.close()
+        manager2.close()
+    
+    def test_replaced_key_file_reloaded(self):
+        """Test that a rewritten key file is picked up by new managers."""
+        key_file = os.path.join(self._tmp.name, "master.key")
+        manager1 = TokenManager(":memory:", key_file)
+        
+        new_key = Fernet.generate_key()
+        with open(key_file, 'wb') as f:
+            f.write(new_key)
+        
+        manager2 = TokenManager(":memory:", key_file)
+        self.assertEqual(manager2.master_key, new_key)
+        self.assertNotEqual(manager2.master_key, manager1.master_key)
+        manager1.close()
+        manager2.close()
     
     def test_save_token(self):
         """Test saving a token."""
@@ -121,11 +165,32 @@ class TestTokenManager(unittest.TestCase):
         self.assertEqual(data['sonarr_url'], "http://newhost:8989")
         self.assertEqual(data['api_token'], "new_key")
     
+    def test_token_cache_invalidation(self):
+        """Test that cached credentials follow updates and deletes."""
+        self.manager.save_token(1, "http://old:8989", "old_key")
+        _, data, _ = self.manager.load_token(1)
+        
+        # Mutating the returned dict must not leak into the cache
+        data['api_token'] = "tampered"
+        _, data, _ = self.manager.load_token(1)
+        self.assertEqual(data['api_token'], "old_key")
+        
+        self.manager.save_token(1, "http://new:8989", "new_key")
+        _, data, _ = self.manager.load_token(1)
+        self.assertEqual(data['api_token'], "new_key")
+        
+        self.manager.delete_token(1)
+        success, data, _ = self.manager.load_token(1)
+        self.assertFalse(success)
+        self.assertIsNone(data)
+    
     def test_multiple_users(self):
         """Test that different users have separate tokens."""
         # Save tokens for two users
-        self.manager.save_token(1, "http://user1:8989", "key1")
-        self.manager.save_token(2, "http://user2:8989", "key2")
+        self.manager.save_tokens_bulk([
+            (1, "http://user1:8989", "key1"),
+            (2, "http://user2:8989", "key2")
+        ])
         
         # Load tokens
         _, data1, _ = self.manager.load_token(1)
@@ -137,21 +202,38 @@ class TestTokenManager(unittest.TestCase):
     
     def test_encrypted_storage(self):
         """Test that tokens are stored encrypted."""
-        import sqlite3
-        
         # Save token
         self.manager.save_token(1, "http://localhost:8989", "secret_key")
         
         # Check database directly
+        with self.manager._connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute("SELECT encrypted_token FROM user_tokens WHERE user_id = ?", (1,))
+            encrypted = cursor.fetchone()[0]
+        
+        # Encrypted data should not contain plain text
+        self.assertNotIn(b"secret_key", encrypted)
+        self.assertNotIn(b"localhost", encrypted)
+    
+    def test_text_token_migration(self):
+        """Test that tokens stored as text are converted and still decrypt."""
+        manager = TokenManager(self.test_db, self.test_key)
+        manager.save_token(1, "http://localhost:8989", "legacy_key")
+        manager.close()
+        
         conn = sqlite3.connect(self.test_db)
-        cursor = conn.cursor()
-        cursor.execute("SELECT encrypted_token FROM user_tokens WHERE user_id = ?", (1,))
-        encrypted = cursor.fetchone()[0]
+        conn.execute("UPDATE user_tokens SET encrypted_token = CAST(encrypted_token AS TEXT)")
+        conn.commit()
         conn.close()
         
-        # Encrypted data should not contain plain text
-        self.assertNotIn("secret_key", encrypted)
-        self.assertNotIn("localhost", encrypted)
+        manager = TokenManager(self.test_db, self.test_key)
+        success, data, _ = manager.load_token(1)
+        self.assertTrue(success)
+        self.assertEqual(data['api_token'], "legacy_key")
+        manager.close()
+        
+        stored_type = peek(self.test_db, "SELECT typeof(encrypted_token) FROM user_tokens")
+        self.assertEqual(stored_type, "blob")
     
     def test_empty_url(self):
         """Test that empty URL is rejected."""
@@ -179,20 +261,17 @@ class TestTokenManager(unittest.TestCase):
     
     def test_encryption_consistency(self):
         """Test that same data encrypts differently each time (due to salt/IV)."""
-        import sqlite3
-        
         # Save same token twice for different users
         self.manager.save_token(1, "http://same:8989", "same_key")
         self.manager.save_token(2, "http://same:8989", "same_key")
         
         # Get encrypted values
-        conn = sqlite3.connect(self.test_db)
-        cursor = conn.cursor()
-        cursor.execute("SELECT encrypted_token FROM user_tokens WHERE user_id = ?", (1,))
-        encrypted1 = cursor.fetchone()[0]
-        cursor.execute("SELECT encrypted_token FROM user_tokens WHERE user_id = ?", (2,))
-        encrypted2 = cursor.fetchone()[0]
-        conn.close()
+        with self.manager._connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute("SELECT encrypted_token FROM user_tokens WHERE user_id = ?", (1,))
+            encrypted1 = cursor.fetchone()[0]
+            cursor.execute("SELECT encrypted_token FROM user_tokens WHERE user_id = ?", (2,))
+            encrypted2 = cursor.fetchone()[0]
         
         # Even though data is same, encrypted values should differ (Fernet includes timestamp/IV)
         self.assertNotEqual(encrypted1, encrypted2)
@@ -0,0 +1,110 @@
+"""
+Unit tests for sonarr_api module.
+Tests the bulk and per-series episode file fetches against a mocked Sonarr.
+"""
+
+import unittest
+from unittest import mock
+
+from sonarr_api import AUTH_ERROR, BAD_REQUEST_ERROR, fetch_episode_files
+
+
+SERIES_DATA = [
+    {'id': 1, 'title': 'Series A'},
+    {'id': 2, 'title': 'Series B'},
+    {'id': 3, 'title': 'Series C'}
+]
+
+
+def episode_file(file_id, series_id, size):
+    """Build one episode file record as Sonarr returns it."""
+    return {
+        'id': file_id,
+        'seriesId': series_id,
+        'size': size,
+        'quality': {'quality': {'name': 'HDTV-1080p'}}
+    }
+
+
+class TestFetchEpisodeFiles(unittest.TestCase):
+    """Test cases for fetch_episode_files."""
+    
+    def fake_sonarr(self, per_series):
+        """
+        Build a fetch_sonarr_data stand-in that rejects unfiltered queries.
+        
+        Args:
+            per_series: Series id -> (files, error) returned for that series
+        """
+        def fetch(endpoint, base_url, api_key, timeout=10, params=None):
+            if not params:
+                return None, BAD_REQUEST_ERROR
+            return per_series[params['seriesId']]
+        return fetch
+    
+    def test_bulk_fetch(self):
+        """Test that one unfiltered request is used when Sonarr allows it."""
+        files = [episode_file(10, 1, 1000), episode_file(11, 2, 2000)]
+        
+        with mock.patch('sonarr_api.fetch_sonarr_data', return_value=(files, None)) as fetch:
+            df, error, warning = fetch_episode_files(SERIES_DATA, "http://sonarr", "key")
+        
+        self.assertIsNone(error)
+        self.assertIsNone(warning)
+        self.assertEqual(df.shape[0], 2)
+        self.assertEqual(fetch.call_count, 1)
+    
+    def test_failed_series_skipped(self):
+        """Test that one failing series does not discard the others' files."""
+        fetch = self.fake_sonarr({
+            1: ([episode_file(10, 1, 1000)], None),
+            2: (None, "❌ Sonarr server error: 503"),
+            3: ([episode_file(30, 3, 3000), episode_file(31, 3, 3100)], None)
+        })
+        
+        with mock.patch('sonarr_api.fetch_sonarr_data', side_effect=fetch):
+            df, error, warning = fetch_episode_files(SERIES_DATA, "http://sonarr", "key")
+        
+        self.assertIsNone(error)
+        self.assertEqual(sorted(df['series_id'].tolist()), [1, 3, 3])
+        self.assertIn("1 of 3", warning)
+        self.assertIn("503", warning)
+    
+    def test_all_series_failed(self):
+        """Test that an error is returned when no series could be fetched."""
+        fetch = self.fake_sonarr({
+            series_id: (None, "❌ Sonarr server error: 503") for series_id in (1, 2, 3)
+        })
+        
+        with mock.patch('sonarr_api.fetch_sonarr_data', side_effect=fetch):
+            df, error, warning = fetch_episode_files(SERIES_DATA, "http://sonarr", "key")
+        
+        self.assertIsNone(df)
+        self.assertEqual(error, "❌ Sonarr server error: 503")
+    
+    def test_auth_error_during_fallback(self):
+        """Test that an auth failure is reported even if other series succeeded."""
+        fetch = self.fake_sonarr({
+            1: ([episode_file(10, 1, 1000)], None),
+            2: (None, AUTH_ERROR),
+            3: ([episode_file(30, 3, 3000)], None)
+        })
+        
+        with mock.patch('sonarr_api.fetch_sonarr_data', side_effect=fetch):
+            df, error, warning = fetch_episode_files(SERIES_DATA, "http://sonarr", "key")
+        
+        self.assertIsNone(df)
+        self.assertEqual(error, AUTH_ERROR)
+    
+    def test_bulk_error_not_retried_per_series(self):
+        """Test that errors other than HTTP 400 skip the per-series fallback."""
+        with mock.patch('sonarr_api.fetch_sonarr_data', return_value=(None, AUTH_ERROR)) as fetch:
+            df, error, warning = fetch_episode_files(SERIES_DATA, "http://sonarr", "key")
+        
+        self.assertIsNone(df)
+        self.assertEqual(error, AUTH_ERROR)
+        self.assertEqual(fetch.call_count, 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -5,26 +5,54 @@ Tests historical data storage, retrieval, and comparison.
 
 import unittest
 import os
-import sys
-from pathlib import Path
+import tempfile
+import numpy as np
 import pandas as pd
 
-# Add parent directory to path
-sys.path.insert(0, str(Path(__file__).parent.parent))
-
 from storage import HistoryDatabase
 
+# Compact dtypes of the sample data; save_analysis must widen these itself
+SAMPLE_DTYPES = {
+    'series_id': 'int32',
+    'episode_count': 'int32',
+    'total_size_gb': 'float32',
+    'avg_size_mb': 'float32',
+    'z_score': 'float32',
+    'year': 'category',
+    'status': 'category'
+}
+
+# Series added in the second snapshot of the comparison tests
+SERIES_D = {
+    'series_id': 4,
+    'title': 'Series D',
+    'year': '2023',
+    'status': 'continuing',
+    'episode_count': 25,
+    'total_size_gb': 12.5,
+    'avg_size_mb': 520.0,
+    'z_score': 0.4,
+    'is_outlier': False
+}
+
+
+def with_series_d(df):
+    """Return a copy of df with SERIES_D appended, built column by column."""
+    return pd.DataFrame({
+        col: np.append(df[col].to_numpy(), SERIES_D[col]) for col in df.columns
+    }).astype(SAMPLE_DTYPES)
+
 
 class TestHistoryDatabase(unittest.TestCase):
     """Test cases for HistoryDatabase class."""
     
-    def setUp(self):
-        """Set up test database before each test."""
-        self.test_db = "test_history_temp.db"
-        self.db = HistoryDatabase(self.test_db)
+    @classmethod
+    def setUpClass(cls):
+        """Create one in-memory test database and the sample data for the whole class."""
+        cls.db = HistoryDatabase(":memory:")
         
-        # Sample data
-        self.sample_df = pd.DataFrame({
+        # Sample data, shared read-only; tests that modify it work on a .copy()
+        cls.sample_df = pd.DataFrame({
             'series_id': [1, 2, 3],
             'title': ['Series A', 'Series B', 'Series C'],
             'year': ['2020', '2021', '2022'],
@@ -34,63 +62,107 @@ class TestHistoryDatabase(unittest.TestCase):
             'avg_size_mb': [500.0, 512.0, 510.0],
             'z_score': [0.1, 0.5, 0.3],
             'is_outlier': [False, False, False]
-        })
+        }).astype(SAMPLE_DTYPES)
         
-        self.sample_stats = {
+        cls.sample_stats = {
             'mean': 507.3,
             'std': 5.0,
             'outlier_count': 0,
             'outlier_percentage': 0.0
         }
     
-    def tearDown(self):
-        """Clean up test database after each test."""
-        if os.path.exists(self.test_db):
-            os.remove(self.test_db)
+    @classmethod
+    def tearDownClass(cls):
+        """Close the shared test database."""
+        cls.db.close()
     
-    def test_save_analysis(self):
-        """Test saving analysis data."""
-        success, msg = self.db.save_analysis(1, self.sample_df, self.sample_stats)
-        self.assertTrue(success)
-        self.assertIn("saved successfully", msg)
+    def setUp(self):
+        """Empty the shared database before each test."""
+        with self.db._connection() as conn:
+            conn.execute("DELETE FROM history")
+            conn.execute("DELETE FROM analysis_summary")
+            conn.execute("DELETE FROM sqlite_sequence")
+            conn.commit()
+        self.db._dates_cache.clear()
     
-    def test_get_analysis_dates(self):
-        """Test getting list of analysis dates."""
+    def test_save_and_read_roundtrip(self):
+        """Test saving one analysis and reading it back through each accessor."""
+        date = "2024-01-01 10:00:00"
+        
         # Initially empty
-        dates = self.db.get_analysis_dates(1)
-        self.assertEqual(len(dates), 0)
+        self.assertEqual(self.db.get_analysis_dates(1), [])
         
-        # Save analysis
+        success, msg = self.db.save_analysis(1, self.sample_df, self.sample_stats, date)
+        self.assertTrue(success)
+        self.assertIn("saved successfully", msg)
+        
+        with self.subTest('dates'):
+            self.assertEqual(self.db.get_analysis_dates(1), [date])
+        
+        with self.subTest('load'):
+            loaded_df = self.db.load_analysis(1, date)
+            
+            self.assertEqual(loaded_df.shape[0], 3)
+            self.assertTrue('series_title' in loaded_df.columns)
+            self.assertEqual(loaded_df['is_outlier'].dtype, bool)
+            self.assertIsNone(self.db.load_analysis(1, "2030-01-01 10:00:00"))
+        
+        with self.subTest('summary'):
+            summary = self.db.get_summary(1, date)
+            
+            self.assertIsNotNone(summary)
+            self.assertEqual(summary['total_series'], 3)
+            self.assertEqual(summary['total_episodes'], 45)
+    
+    def test_get_analysis_dates_cached_copy(self):
+        """Test that cached dates are returned as a copy callers can modify."""
         self.db.save_analysis(1, self.sample_df, self.sample_stats, "2024-01-01 10:00:00")
         
-        # Should have one date
         dates = self.db.get_analysis_dates(1)
-        self.assertEqual(len(dates), 1)
-        self.assertEqual(dates[0], "2024-01-01 10:00:00")
+        dates.clear()
+        self.assertEqual(self.db.get_analysis_dates(1), ["2024-01-01 10:00:00"])
     
-    def test_load_analysis(self):
-        """Test loading analysis data."""
-        date = "2024-01-01 10:00:00"
-        self.db.save_analysis(1, self.sample_df, self.sample_stats, date)
+    def test_data_version(self):
+        """Test that every write bumps the user's data version."""
+        version = self.db.data_version(1)
         
-        # Load data
-        loaded_df = self.db.load_analysis(1, date)
+        self.db.save_analysis(1, self.sample_df, self.sample_stats, "2024-01-01 10:00:00")
+        self.assertGreater(self.db.data_version(1), version)
         
-        self.assertIsNotNone(loaded_df)
-        self.assertEqual(len(loaded_df), 3)
-        self.assertTrue('series_title' in loaded_df.columns)
+        version = self.db.data_version(1)
+        other = self.db.data_version(2)
+        self.db.delete_analysis(1, "2024-01-01 10:00:00")
+        self.assertGreater(self.db.data_version(1), version)
+        self.assertEqual(self.db.data_version(2), other)
     
-    def test_get_summary(self):
-        """Test getting summary statistics."""
-        date = "2024-01-01 10:00:00"
-        self.db.save_analysis(1, self.sample_df, self.sample_stats, date)
+    def test_get_latest_date(self):
+        """Test getting the most recent analysis date."""
+        self.assertIsNone(self.db.get_latest_date(1))
         
-        # Get summary
-        summary = self.db.get_summary(1, date)
+        self.db.save_analysis(1, self.sample_df, self.sample_stats, "2024-01-01 10:00:00")
+        self.db.save_analysis(1, self.sample_df, self.sample_stats, "2024-02-01 10:00:00")
         
-        self.assertIsNotNone(summary)
-        self.assertEqual(summary['total_series'], 3)
-        self.assertEqual(summary['total_episodes'], 45)
+        self.assertEqual(self.db.get_latest_date(1), "2024-02-01 10:00:00")
+        self.assertEqual(self.db.get_latest_date(1), self.db.get_analysis_dates(1)[0])
+    
+    def test_save_many(self):
+        """Test saving several analyses in one transaction."""
+        success, msg = self.db.save_many(1, [
+            ("2024-01-01 10:00:00", self.sample_df, self.sample_stats),
+            ("2024-02-01 10:00:00", self.sample_df, self.sample_stats)
+        ])
+        self.assertTrue(success)
+        self.assertEqual(self.db.get_analysis_dates(1), ["2024-02-01 10:00:00", "2024-01-01 10:00:00"])
+        self.assertEqual(self.db.get_summary(1, "2024-02-01 10:00:00")['total_series'], 3)
+        
+        # One existing date rejects the whole batch
+        success, msg = self.db.save_many(1, [
+            ("2024-03-01 10:00:00", self.sample_df, self.sample_stats),
+            ("2024-01-01 10:00:00", self.sample_df, self.sample_stats)
+        ])
+        self.assertFalse(success)
+        self.assertIn("already exists", msg)
+        self.assertEqual(len(self.db.get_analysis_dates(1)), 2)
     
     def test_user_isolation(self):
         """Test that users have separate analysis history."""
@@ -135,8 +207,9 @@ class TestHistoryDatabase(unittest.TestCase):
         # Save two analyses
         df1 = self.sample_df.copy()
         df2 = self.sample_df.copy()
-        df2['episode_count'] = [12, 22, 17]  # Changed counts
-        df2['total_size_gb'] = [6.0, 11.0, 8.5]  # Changed sizes
+        # Changed counts and sizes, derived column-wise so the compact dtypes are kept
+        df2['episode_count'] = df1['episode_count'] + 2
+        df2['total_size_gb'] = df1['total_size_gb'] + 1
         
         self.db.save_analysis(1, df1, self.sample_stats, "2024-01-01 10:00:00")
         self.db.save_analysis(1, df2, self.sample_stats, "2024-02-01 10:00:00")
@@ -144,8 +217,7 @@ class TestHistoryDatabase(unittest.TestCase):
         # Compare
         comparison = self.db.compare_dates(1, "2024-01-01 10:00:00", "2024-02-01 10:00:00")
         
-        self.assertIsNotNone(comparison)
-        self.assertEqual(len(comparison), 3)
+        self.assertEqual(comparison.shape[0], 3)
         
         # Check changes are detected
         self.assertTrue('episodes_change' in comparison.columns)
@@ -157,17 +229,7 @@ class TestHistoryDatabase(unittest.TestCase):
         df1 = self.sample_df.copy()
         
         # Second analysis with 4 series (one new)
-        df2 = pd.concat([df1, pd.DataFrame({
-            'series_id': [4],
-            'title': ['Series D'],
-            'year': ['2023'],
-            'status': ['continuing'],
-            'episode_count': [25],
-            'total_size_gb': [12.5],
-            'avg_size_mb': [520.0],
-            'z_score': [0.4],
-            'is_outlier': [False]
-        })], ignore_index=True)
+        df2 = with_series_d(df1)
         
         self.db.save_analysis(1, df1, self.sample_stats, "2024-01-01 10:00:00")
         self.db.save_analysis(1, df2, self.sample_stats, "2024-02-01 10:00:00")
@@ -182,6 +244,32 @@ class TestHistoryDatabase(unittest.TestCase):
         new_series = comparison[comparison['status'] == 'new']
         self.assertEqual(len(new_series), 1)
     
+    def test_compare_dates_summary(self):
+        """Test SQL comparison summary matches the detailed comparison."""
+        df1 = self.sample_df.copy()
+        df2 = self.sample_df.iloc[1:].copy()  # Series A removed
+        df2['total_size_gb'] = [11.0, 8.5]
+        df2['avg_size_mb'] = [520.0, 515.0]
+        df2 = with_series_d(df2)
+        
+        self.db.save_analysis(1, df1, self.sample_stats, "2024-01-01 10:00:00")
+        self.db.save_analysis(1, df2, self.sample_stats, "2024-02-01 10:00:00")
+        
+        summary = self.db.compare_dates_summary(1, "2024-01-01 10:00:00", "2024-02-01 10:00:00")
+        comparison = self.db.compare_dates(1, "2024-01-01 10:00:00", "2024-02-01 10:00:00")
+        
+        self.assertIsNotNone(summary)
+        self.assertEqual(summary['new_count'], 1)
+        self.assertEqual(summary['removed_count'], 1)
+        self.assertAlmostEqual(summary['total_size_change_gb'], comparison['size_change_gb'].sum())
+        self.assertAlmostEqual(
+            summary['avg_size_change_mb'],
+            comparison[comparison['status'] == 'existing']['avg_size_change_mb'].mean()
+        )
+        
+        # Missing date gives no summary
+        self.assertIsNone(self.db.compare_dates_summary(1, "2024-01-01 10:00:00", "2030-01-01 10:00:00"))
+    
     def test_get_time_series(self):
         """Test getting time series for a specific series."""
         # Save multiple analyses
@@ -194,22 +282,45 @@ class TestHistoryDatabase(unittest.TestCase):
         # Get time series for series_id 1
         ts = self.db.get_time_series(1, 1, 'total_size_gb')
         
-        self.assertIsNotNone(ts)
-        self.assertEqual(len(ts), 2)
+        self.assertEqual(ts.shape[0], 2)
         self.assertTrue('analysis_date' in ts.columns)
         self.assertTrue('total_size_gb' in ts.columns)
+        
+        # Raw rows skip the DataFrame
+        rows = self.db.get_time_series(1, 1, 'total_size_gb', as_dataframe=False)
+        self.assertEqual([r[2] for r in rows], list(ts['total_size_gb']))
+        
+        # Metrics outside the whitelist never reach SQL
+        with self.assertRaises(ValueError):
+            self.db.get_time_series(1, 1, 'total_size_gb; DROP TABLE history')
+    
+    def test_get_time_series_multi(self):
+        """Test getting several metrics for a series in one call."""
+        self.db.save_analysis(1, self.sample_df, self.sample_stats, "2024-01-01 10:00:00")
+        
+        df2 = self.sample_df.copy()
+        df2.loc[df2['series_id'] == 1, 'total_size_gb'] = 6.0
+        self.db.save_analysis(1, df2, self.sample_stats, "2024-02-01 10:00:00")
+        
+        ts = self.db.get_time_series_multi(1, 1, ('total_size_gb', 'episode_count', 'avg_size_mb'))
+        
+        self.assertEqual(ts.shape[0], 2)
+        for col in ['analysis_date', 'series_title', 'total_size_gb', 'episode_count', 'avg_size_mb']:
+            self.assertTrue(col in ts.columns)
+        self.assertEqual(ts['total_size_gb'].tolist(), [5.0, 6.0])
     
     def test_get_global_trends(self):
         """Test getting global trend data."""
         # Save multiple analyses
-        self.db.save_analysis(1, self.sample_df, self.sample_stats, "2024-01-01 10:00:00")
-        self.db.save_analysis(1, self.sample_df, self.sample_stats, "2024-02-01 10:00:00")
+        self.db.save_many(1, [
+            ("2024-01-01 10:00:00", self.sample_df, self.sample_stats),
+            ("2024-02-01 10:00:00", self.sample_df, self.sample_stats)
+        ])
         
         # Get trends
         trends = self.db.get_global_trends(1)
         
-        self.assertIsNotNone(trends)
-        self.assertEqual(len(trends), 2)
+        self.assertEqual(trends.shape[0], 2)
         self.assertTrue('analysis_date' in trends.columns)
         self.assertTrue('total_storage_gb' in trends.columns)
     
@@ -233,8 +344,10 @@ class TestHistoryDatabase(unittest.TestCase):
     def test_cleanup_old_data(self):
         """Test cleaning up old data."""
         # Save analyses with different dates
-        self.db.save_analysis(1, self.sample_df, self.sample_stats, "2023-01-01 10:00:00")
-        self.db.save_analysis(1, self.sample_df, self.sample_stats, "2024-01-01 10:00:00")
+        self.db.save_many(1, [
+            ("2023-01-01 10:00:00", self.sample_df, self.sample_stats),
+            ("2024-01-01 10:00:00", self.sample_df, self.sample_stats)
+        ])
         
         # Cleanup data older than 180 days
         success, msg = self.db.cleanup_old_data(1, 180)
@@ -249,14 +362,26 @@ class TestHistoryDatabase(unittest.TestCase):
         """Test exporting data to CSV."""
         self.db.save_analysis(1, self.sample_df, self.sample_stats, "2024-01-01 10:00:00")
         
-        output_file = "test_export.csv"
-        success, msg = self.db.export_to_csv(1, output_file)
+        with tempfile.TemporaryDirectory() as tmp:
+            output_file = os.path.join(tmp, "export.csv")
+            success, msg = self.db.export_to_csv(1, output_file)
+            
+            self.assertTrue(success)
+            self.assertTrue(os.path.exists(output_file))
+    
+    def test_export_to_csv_buffer(self):
+        """Test exporting data to an in-memory buffer."""
+        import io
         
-        self.assertTrue(success)
-        self.assertTrue(os.path.exists(output_file))
+        self.db.save_analysis(1, self.sample_df, self.sample_stats, "2024-01-01 10:00:00")
+        
+        buf = io.BytesIO()
+        success, msg = self.db.export_to_csv(1, buf)
         
-        # Clean up
-        os.remove(output_file)
+        self.assertTrue(success)
+        lines = buf.getvalue().decode('utf-8').strip().split('\n')
+        self.assertEqual(len(lines), 4)  # header + 3 series
+        self.assertIn('series_title', lines[0])
 
 
 if __name__ == '__main__':